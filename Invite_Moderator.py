@@ -1,48 +1,1256 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 import re
 import aiohttp
 import asyncio
 import json
 import os
+import time
+import heapq
+import itertools
+import math
+import sqlite3
+import weakref
+import bisect
+import hashlib
+import codecs
+import mmap
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 
 TOKEN = ""
 config_file = "config.json"
+config_backup_file = "config.json.bak"
+# Config changes are coalesced: a write happens CONFIG_SAVE_DELAY seconds
+# after the latest change, but never later than CONFIG_SAVE_MAX_DELAY seconds
+# after the first unsaved one.
+CONFIG_SAVE_DELAY = 1.0
+CONFIG_SAVE_MAX_DELAY = 5.0
+
+# Invite lookups go through one pooled HTTP session owned by the bot and a
+# bounded in-memory cache of code -> target guild. Negative answers (unknown or
+# expired invites) are cached too, with a shorter lifetime.
+INVITE_API_URL = os.environ.get('INVITE_API_URL', "https://discord.com/api/v10/invites/{code}")
+INVITE_CACHE_SIZE = 10000
+INVITE_CACHE_TTL = 6 * 60 * 60
+INVITE_NEGATIVE_TTL = 30 * 60
+HTTP_POOL_LIMIT = 50
+HTTP_TIMEOUT = 10
+# Maximum number of invite codes from a single message resolved at once.
+INVITE_LOOKUP_CONCURRENCY = 5
+# Shared budget for the invite endpoint across all messages: a token bucket
+# (requests per second plus burst), a global cap on requests in flight, and
+# limits after which lookups are deferred and only the cache is consulted.
+INVITE_RATE_PER_SECOND = 4
+INVITE_RATE_BURST = 10
+INVITE_MAX_IN_FLIGHT = 8
+INVITE_QUEUE_LIMIT = 500
+INVITE_MAX_WAIT = 10
+# Verdicts are also memoized per target guild id, so different invite codes
+# for an already classified guild skip the keyword match.
+GUILD_MEMO_SIZE = 50000
+# Resolved invites are also kept on disk so a restart does not start cold.
+# Writes are batched and flushed from a worker thread.
+VERDICT_DB_FILE = "invite_verdicts.db"
+VERDICT_STORE_TTL = 24 * 60 * 60
+VERDICT_FLUSH_INTERVAL = 2
+VERDICT_FLUSH_BATCH = 200
+# Expired verdicts are deleted at most this often, during a flush.
+VERDICT_PRUNE_INTERVAL = 5 * 60
+# Warnings posted after a deletion are removed again after WARNING_LIFETIME
+# seconds by a shared timer wheel with DELETE_WHEEL_RESOLUTION-second slots;
+# warnings due in the same slot and channel are bulk-deleted together.
+WARNING_LIFETIME = 5
+DELETE_WHEEL_RESOLUTION = 1.0
+BULK_DELETE_LIMIT = 100
+# Raid mode: once a channel sees RAID_THRESHOLD NSFW invite hits within
+# RAID_WINDOW seconds, offending messages there are collected for
+# RAID_BATCH_DELAY seconds, bulk-deleted together and answered with one
+# summary warning. The channel leaves raid mode after RAID_COOLDOWN quiet
+# seconds.
+RAID_THRESHOLD = 5
+RAID_WINDOW = 30
+RAID_COOLDOWN = 60
+RAID_BATCH_DELAY = 1.5
+# Hot-path stage latencies are recorded in fixed-bucket histograms and served
+# as Prometheus text on 127.0.0.1:METRICS_PORT/metrics (0 disables it).
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9108'))
+METRICS_STAGES = ('extract', 'attachment', 'cache_lookup', 'invite_api', 'classify', 'delete', 'send', 'bulk_delete')
+# Edited messages are only rescanned when their content or embed text
+# changed; per-message digests and already checked codes are remembered for
+# the most recent SCAN_DEDUP_SIZE messages.
+SCAN_DEDUP_SIZE = 20000
+# Small text attachments are streamed through the pooled HTTP session and
+# scanned chunk by chunk; at most ATTACHMENT_MAX_BYTES are read per file, so
+# memory stays flat however large the upload is.
+SCAN_TEXT_ATTACHMENTS = True
+ATTACHMENT_MAX_BYTES = 256 * 1024
+ATTACHMENT_CHUNK_SIZE = 16 * 1024
+ATTACHMENT_MAX_COUNT = 3
+TEXT_ATTACHMENT_EXTENSIONS = ('.txt', '.md', '.log', '.csv', '.json', '.html', '.xml', '.yml', '.yaml', '.ini', '.cfg')
+# Imported lists of known-NSFW and known-safe guild ids, checked before the
+# keyword heuristic. Each file is a sorted array of unsigned 64-bit ids that
+# is memory-mapped on load and searched by bisection.
+GUILD_BLOCKLIST_FILE = "guild_blocklist.bin"
+GUILD_ALLOWLIST_FILE = "guild_allowlist.bin"
+# Cross-guild spread detection: an invite code seen in at least
+# SPREAD_GUILD_THRESHOLD different guilds within SPREAD_WINDOW seconds is
+# flagged as spreading. Each code remembers when it was last seen in each of
+# at most SPREAD_GUILDS_PER_CODE guilds.
+SPREAD_WINDOW = 10 * 60
+SPREAD_GUILD_THRESHOLD = 4
+SPREAD_GUILDS_PER_CODE = 32
+SPREAD_MAX_CODES = 50000
+SPREAD_COMPACT_INTERVAL = 60
+# Shadow evaluation of a candidate keyword list: one keyword per line in
+# SHADOW_KEYWORDS_FILE (no file = disabled). Guild names seen by the live
+# filter are queued and compared against the candidate in the background;
+# the candidate never deletes anything.
+SHADOW_KEYWORDS_FILE = "shadow_keywords.txt"
+SHADOW_QUEUE_LIMIT = 1000
+SHADOW_SEEN_SIZE = 20000
+SHADOW_SAMPLE_SIZE = 20
+SHADOW_BATCH_SIZE = 50
+# Lookup priorities: lower values are served first.
+PRIORITY_FRESH = 0
+PRIORITY_RETRY = 1
+# Messages whose invites could not be resolved are re-checked in the
+# background until the scheduler's pause and queue have had time to drain
+# plus DEFERRED_RECHECK_GRACE seconds, but never for longer than
+# DEFERRED_RECHECK_MAX seconds in total.
+DEFERRED_RECHECK_GRACE = 60
+DEFERRED_RECHECK_MAX = 60 * 60
 
 def load_config():
-    # Load the list of guild IDs where NSFW invite filtering is enabled; the configuration is a small JSON file that stores an 'active_guilds' list and we return a set for efficient membership checks, falling back to an empty set and creating a default file if the file is missing or cannot be parsed, and we tolerate parse errors so a transient corrupted file does not stop the bot from running.
-    if os.path.exists(config_file):
+    # Load the persisted configuration: the 'active_guilds' list of guild IDs where NSFW invite filtering is enabled and the per-guild keyword overrides under 'guild_keywords'. The main file is tried first and the last-known-good backup second, so a corrupted config.json does not silently disable filtering everywhere; a default file is created only when neither exists.
+    data = read_config_data()
+    if data is None:
+        if not os.path.exists(config_file) and not os.path.exists(config_backup_file):
+            try:
+                save_config(set())
+            except OSError as e:
+                print(f"Could not create {config_file}: {e}")
+        return {}
+    return data
+
+def read_config_data():
+    # Return the parsed config from the main file, falling back to the
+    # backup copy; None if neither can be read.
+    for path in (config_file, config_backup_file):
+        if not os.path.exists(path):
+            continue
         try:
-            with open(config_file, 'r') as f:
+            with open(path, 'r') as f:
                 data = json.load(f)
-                return set(data.get('active_guilds', []))
-        except Exception:
-            return set()
-    else:
-        save_config(set())
-        return set()
+            if path == config_backup_file:
+                print(f"{config_file} is missing or unreadable, loaded last-known-good {config_backup_file}")
+            return data
+        except Exception as e:
+            print(f"Could not read {path}: {e}")
+    if os.path.exists(config_file) or os.path.exists(config_backup_file):
+        print("WARNING: no readable config found, NSFW invite filtering starts inactive in every guild")
+    return None
+
+def config_snapshot():
+    # JSON-ready copy of the persisted state, taken on the event loop.
+    return {
+        'active_guilds': sorted(guilds),
+        'guild_keywords': guild_keywords.to_config()
+    }
+
+def write_json_atomic(path, data):
+    # Write to a temporary file, fsync it and rename it over the target so
+    # readers only ever see the old or the new complete file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def save_config_data(data):
+    # Persist a config snapshot and then refresh the last-known-good backup.
+    # Raises on failure so callers can report it.
+    write_json_atomic(config_file, data)
+    write_json_atomic(config_backup_file, data)
 
 def save_config(guilds):
-    # Persist the active guilds set to disk as JSON; convert the set to a list because JSON cannot represent sets and perform a best-effort write that silently ignores failures so the bot continues running if the file system is unavailable.
+    # Synchronously persist the active guilds set; used at startup before the
+    # event loop runs. Runtime changes go through bot.config_writer instead.
+    save_config_data({'active_guilds': sorted(guilds)})
+    print(f"Config saved with {len(guilds)} active guilds")
+
+class InviteCache:
+    # Bounded LRU cache mapping invite codes to their InviteTarget (guild id and name). Each entry carries its own expiry so resolved invites can live for hours while negative results (None, for 404/expired invites) are retried sooner; the least recently used entry is evicted once maxsize is reached and hit/miss counters make the cache's effectiveness visible.
+    _MISSING = object()
+
+    def __init__(self, maxsize=INVITE_CACHE_SIZE, ttl=INVITE_CACHE_TTL, negative_ttl=INVITE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, code):
+        # Return the cached InviteTarget (None for a known-bad invite) or
+        # InviteCache._MISSING when the code is unknown or has expired.
+        entry = self._entries.get(code)
+        if entry is None:
+            self.misses += 1
+            return self._MISSING
+        expires_at, target = entry
+        if expires_at <= time.monotonic():
+            del self._entries[code]
+            self.misses += 1
+            return self._MISSING
+        self._entries.move_to_end(code)
+        self.hits += 1
+        return target
+
+    def put(self, code, target, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if target is not None else self.negative_ttl
+        self._entries[code] = (time.monotonic() + ttl, target)
+        self._entries.move_to_end(code)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total) if total else 0.0
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': hit_rate,
+        }
+
+
+class SingleFlight:
+    # Coalesces concurrent calls for the same key into one in-flight task: the first caller starts the work, later callers await the same task and receive the same result or exception. Waiters are shielded so a cancelled waiter (e.g. find_nsfw_invite dropping slower lookups) never cancels the shared work other messages depend on. `saved` counts calls that joined an existing task instead of starting their own.
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.saved = 0
+
+    async def do(self, key, factory):
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        else:
+            self.saved += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {'calls': self.calls, 'saved': self.saved, 'in_flight': len(self._inflight)}
+
+
+class InviteLookupDeferred(Exception):
+    # Raised when an invite cannot be resolved right now because the API budget is exhausted or Discord answered 429; the caller should fall back to cache-only and re-check the message later instead of treating the invite as safe.
+    pass
+
+
+class InviteScheduler:
+    # Shared scheduler for invite API requests. A token bucket limits the request rate, a global counter caps requests in flight, and waiting requests are served from a priority heap so fresh messages go before background re-checks. Discord's rate-limit headers (Retry-After, X-RateLimit-Remaining / X-RateLimit-Reset-After) pause all dispatching until the advertised reset; when that pause or the queue grows past its limits, acquire() raises InviteLookupDeferred immediately so callers degrade to cache-only.
+    def __init__(self, rate=INVITE_RATE_PER_SECOND, burst=INVITE_RATE_BURST,
+                 max_in_flight=INVITE_MAX_IN_FLIGHT, max_queue=INVITE_QUEUE_LIMIT,
+                 max_wait=INVITE_MAX_WAIT):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.consecutive_429 = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.granted = 0
+        self.deferred = 0
+        self.rate_limited = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def budget_exhausted(self):
+        # True when a new request would have to wait longer than max_wait or
+        # the queue is already full.
+        now = time.monotonic()
+        if self.blocked_until - now > self.max_wait:
+            return True
+        if len(self._queue) >= self.max_queue:
+            return True
+        self._refill(now)
+        backlog = len(self._queue) + 1 - self.tokens
+        return backlog > 0 and backlog / self.rate > self.max_wait
+
+    async def acquire(self, priority=PRIORITY_FRESH):
+        if self.budget_exhausted():
+            self.deferred += 1
+            raise InviteLookupDeferred()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # If the slot was granted just before cancellation, hand it back.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._queue and self.in_flight < self.max_in_flight:
+            if now < self.blocked_until or self.tokens < 1:
+                break
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.tokens -= 1
+            self.in_flight += 1
+            self.granted += 1
+            future.set_result(None)
+        if self._queue and self.in_flight < self.max_in_flight:
+            # Wake up when the pause ends or the next token is available;
+            # otherwise release() dispatches once a request finishes.
+            delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def observe(self, status, headers):
+        # Update the pause from a response's rate-limit headers. A 429
+        # without usable headers backs off exponentially.
+        now = time.monotonic()
+        reset_after = _parse_seconds(headers.get('X-RateLimit-Reset-After'))
+        if status == 429:
+            self.rate_limited += 1
+            self.consecutive_429 += 1
+            retry_after = _parse_seconds(headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = reset_after
+            if retry_after is None:
+                retry_after = min(60.0, 0.5 * 2 ** self.consecutive_429)
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        else:
+            self.consecutive_429 = 0
+            if headers.get('X-RateLimit-Remaining') == '0' and reset_after is not None:
+                self.blocked_until = max(self.blocked_until, now + reset_after)
+
+    def drain_time(self):
+        # Seconds until the current pause has ended and the queued requests
+        # have been served at the configured rate.
+        return max(0.0, self.blocked_until - time.monotonic()) + len(self._queue) / self.rate
+
+    def retry_delay(self):
+        # How long a deferred lookup should wait before trying again.
+        return max(1.0, self.blocked_until - time.monotonic())
+
+    def stats(self):
+        return {
+            'granted': self.granted,
+            'deferred': self.deferred,
+            'rate_limited': self.rate_limited,
+            'queued': len(self._queue),
+            'in_flight': self.in_flight,
+            'blocked_for': max(0.0, self.blocked_until - time.monotonic()),
+        }
+
+
+def _parse_seconds(value):
     try:
-        config_data = {
-            'active_guilds': list(guilds)
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+InviteTarget = namedtuple('InviteTarget', ['guild_id', 'guild_name'])
+
+
+class GuildVerdictMemo:
+    # Bounded LRU memo of target guild id -> (guild name, is_nsfw). Many different invite codes point at the same guild, so once one of them has been classified the others reuse the verdict instead of running the keyword matcher again. Fresh API answers go through observe(), which re-classifies only when the guild's name differs from the memoized one; cached or stored answers go through classify(), which trusts the memo because it always reflects the most recently fetched name. Entries are only ever created by classifying a name with the running KEYWORDS, never restored from disk, so a keyword change takes effect on restart.
+    def __init__(self, maxsize=GUILD_MEMO_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _remember(self, guild_id, name, is_nsfw):
+        self._entries[guild_id] = (name, is_nsfw)
+        self._entries.move_to_end(guild_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def observe(self, guild_id, name):
+        # Verdict for a freshly fetched (guild id, name).
+        if guild_id is None:
+            return is_nsfw_server_name(name)
+        entry = self._entries.get(guild_id)
+        if entry is not None:
+            if entry[0] == name:
+                self.hits += 1
+                self._entries.move_to_end(guild_id)
+                return entry[1]
+            self.invalidations += 1
+        self.misses += 1
+        is_nsfw = is_nsfw_server_name(name)
+        self._remember(guild_id, name, is_nsfw)
+        return is_nsfw
+
+    def classify(self, guild_id, name):
+        # Verdict for a cached or stored (guild id, name).
+        entry = self._entries.get(guild_id) if guild_id is not None else None
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(guild_id)
+            return entry[1]
+        return self.observe(guild_id, name)
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
+
+
+InviteRecord = namedtuple('InviteRecord', ['guild_id', 'guild_name', 'verdict', 'expires_at'])
+
+
+class VerdictStore:
+    # SQLite-backed store of invite code -> (guild id, guild name, verdict, expiry) that survives restarts. The database is opened lazily on first use and every query runs on a single worker thread that owns the connection, so the event loop never blocks on disk I/O; writes are buffered and flushed in batches (every VERDICT_FLUSH_INTERVAL seconds or VERDICT_FLUSH_BATCH records), and reads consult the unflushed buffer first.
+    def __init__(self, path=VERDICT_DB_FILE, flush_interval=VERDICT_FLUSH_INTERVAL, flush_batch=VERDICT_FLUSH_BATCH):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='verdict-store')
+        self._pending = {}
+        self._flush_handle = None
+        self._flush_task = None
+        self._last_prune = 0.0
+        self.reads = 0
+        self.writes = 0
+        self.flushes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS invite_verdicts (
+                code TEXT PRIMARY KEY,
+                guild_id INTEGER,
+                guild_name TEXT,
+                verdict TEXT,
+                expires_at REAL
+            )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS invite_verdicts_expiry ON invite_verdicts (expires_at)')
+            self._conn.commit()
+        return self._conn
+
+    def _get_sync(self, code):
+        row = self._connect().execute(
+            'SELECT guild_id, guild_name, verdict, expires_at FROM invite_verdicts WHERE code = ?', (code,)
+        ).fetchone()
+        return InviteRecord(*row) if row else None
+
+    def _write_sync(self, rows):
+        conn = self._connect()
+        conn.executemany(
+            'INSERT OR REPLACE INTO invite_verdicts (code, guild_id, guild_name, verdict, expires_at) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        now = time.time()
+        if now - self._last_prune >= VERDICT_PRUNE_INTERVAL:
+            # Range delete on the expiry index, not a scan per flush.
+            conn.execute('DELETE FROM invite_verdicts WHERE expires_at < ?', (now,))
+            self._last_prune = now
+        conn.commit()
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def get(self, code):
+        # Return the stored InviteRecord for a code, or None if it is unknown
+        # or expired.
+        record = self._pending.get(code)
+        if record is None:
+            self.reads += 1
+            record = await self._run(self._get_sync, code)
+        if record is None or record.expires_at <= time.time():
+            return None
+        return record
+
+    def put(self, code, guild_id, guild_name, verdict, ttl=VERDICT_STORE_TTL):
+        self._pending[code] = InviteRecord(guild_id, guild_name, verdict, time.time() + ttl)
+        if len(self._pending) >= self.flush_batch:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self.flush_interval)
+
+    def _schedule_flush(self, delay):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        # Write all buffered records in one transaction. On failure the
+        # records are put back (unless newer ones replaced them) and retried
+        # on the next flush.
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [(code, *record) for code, record in batch.items()]
+        try:
+            await self._run(self._write_sync, rows)
+            self.writes += len(rows)
+            self.flushes += 1
+        except Exception as e:
+            print(f"Failed to write {len(rows)} invite verdicts: {e}")
+            for code, record in batch.items():
+                self._pending.setdefault(code, record)
+            self._schedule_flush(self.flush_interval)
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=True)
+
+
+class DeferredDeleter:
+    # Timer wheel for deleting messages later without parking a coroutine per message. schedule() drops (channel id, message id) into the slot for its due time; one background task sleeps until the earliest slot is due and deletes everything in it, bulk-deleting per channel (up to BULK_DELETE_LIMIT ids per request) and falling back to single deletes when bulk delete is not permitted. Only ids are kept, so pending deletions hold no Message objects.
+    def __init__(self, resolution=DELETE_WHEEL_RESOLUTION):
+        self.resolution = resolution
+        self._slots = {}
+        self._slot_heap = []
+        self._changed = None
+        self._task = None
+        self.scheduled = 0
+        self.deleted = 0
+        self.api_calls = 0
+
+    def schedule(self, channel_id, message_id, delay):
+        slot = math.ceil((time.monotonic() + delay) / self.resolution)
+        channels = self._slots.get(slot)
+        if channels is None:
+            channels = self._slots[slot] = {}
+            heapq.heappush(self._slot_heap, slot)
+        channels.setdefault(channel_id, []).append(message_id)
+        self.scheduled += 1
+        if self._task is None or self._task.done():
+            self._changed = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        else:
+            self._changed.set()
+
+    async def _run(self):
+        while self._slot_heap:
+            delay = self._slot_heap[0] * self.resolution - time.monotonic()
+            if delay > 0:
+                # Wake early if an earlier slot is scheduled meanwhile.
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            slot = heapq.heappop(self._slot_heap)
+            for channel_id, message_ids in self._slots.pop(slot).items():
+                await self.delete_now(channel_id, message_ids)
+
+    async def delete_now(self, channel_id, message_ids):
+        # Delete messages in one channel with as few requests as possible.
+        for start in range(0, len(message_ids), BULK_DELETE_LIMIT):
+            chunk = message_ids[start:start + BULK_DELETE_LIMIT]
+            if len(chunk) > 1:
+                try:
+                    self.api_calls += 1
+                    await bot.http.delete_messages(channel_id, chunk)
+                    self.deleted += len(chunk)
+                    continue
+                except discord.errors.Forbidden:
+                    # Bulk delete needs Manage Messages; the bot can
+                    # still delete its own messages one by one.
+                    pass
+                except Exception:
+                    continue
+            for message_id in chunk:
+                try:
+                    self.api_calls += 1
+                    await bot.http.delete_message(channel_id, message_id)
+                    self.deleted += 1
+                except Exception:
+                    pass
+
+    async def close(self):
+        # Delete everything still pending instead of leaving it behind.
+        if self._task is not None:
+            self._task.cancel()
+        pending, self._slots, self._slot_heap = self._slots, {}, []
+        for channels in pending.values():
+            for channel_id, message_ids in channels.items():
+                await self.delete_now(channel_id, message_ids)
+
+    def stats(self):
+        return {
+            'scheduled': self.scheduled,
+            'pending': sum(len(ids) for channels in self._slots.values() for ids in channels.values()),
+            'deleted': self.deleted,
+            'api_calls': self.api_calls,
         }
-        with open(config_file, 'w') as f:
-            json.dump(config_data, f, indent=2)
-        print(f"Config saved with {len(guilds)} active guilds")
-    except Exception:
-        # Ignore write errors to avoid crashing in production if disk is
-        # not writable; administrators can check logs to diagnose.
-        pass
 
-INTENTS = discord.Intents.default()
-INTENTS.message_content = True
 
-bot = commands.Bot(command_prefix='!', intents=INTENTS)
+class RaidGuard:
+    # Per-channel raid detection and batched enforcement. record_hit() keeps a sliding window of hit timestamps per channel and reports whether the channel is in raid mode; while it is, enqueue() buffers offending messages and a timer flushes each channel's buffer with one bulk delete and one summary warning instead of a delete, a warning and a warning cleanup per message. Counters track hits, batches and the API calls that batching saved.
+    def __init__(self, threshold=RAID_THRESHOLD, window=RAID_WINDOW, cooldown=RAID_COOLDOWN, batch_delay=RAID_BATCH_DELAY):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.batch_delay = batch_delay
+        self._hits = {}
+        self._raid_until = {}
+        self._batches = {}
+        self._last_prune = time.monotonic()
+        self.hits = 0
+        self.raids = 0
+        self.batches = 0
+        self.batched_messages = 0
+        self.api_calls_saved = 0
+
+    def record_hit(self, channel_id):
+        # Register one NSFW invite hit and return True if the channel is
+        # (now) in raid mode.
+        now = time.monotonic()
+        self.hits += 1
+        hits = self._hits.setdefault(channel_id, deque())
+        hits.append(now)
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if len(hits) >= self.threshold:
+            if self._raid_until.get(channel_id, 0) <= now:
+                self.raids += 1
+                print(f"Raid mode enabled in channel {channel_id}")
+            self._raid_until[channel_id] = now + self.cooldown
+        elif self._raid_until.get(channel_id, 0) <= now:
+            self._raid_until.pop(channel_id, None)
+        if now - self._last_prune >= self.window:
+            self.prune(now)
+        return channel_id in self._raid_until
+
+    def prune(self, now=None):
+        # Forget channels whose hits have all left the window and whose raid
+        # mode has ended, so quiet channels do not keep their state forever.
+        now = time.monotonic() if now is None else now
+        self._last_prune = now
+        cutoff = now - self.window
+        for channel_id in list(self._hits):
+            hits = self._hits[channel_id]
+            while hits and hits[0] <= cutoff:
+                hits.popleft()
+            if not hits:
+                del self._hits[channel_id]
+        for channel_id in [channel_id for channel_id, until in self._raid_until.items() if until <= now]:
+            del self._raid_until[channel_id]
+
+    def active_channels(self):
+        self.prune()
+        return list(self._raid_until)
+
+    def enqueue(self, message, name):
+        batch = self._batches.get(message.channel.id)
+        if batch is None:
+            batch = self._batches[message.channel.id] = {'channel': message.channel, 'ids': [], 'authors': {}, 'names': set()}
+            asyncio.get_running_loop().call_later(self.batch_delay, lambda: spawn_background(self.flush(message.channel.id)))
+        batch['ids'].append(message.id)
+        batch['authors'].setdefault(message.author.id, message.author.mention)
+        batch['names'].add(name)
+        if len(batch['ids']) >= BULK_DELETE_LIMIT:
+            spawn_background(self.flush(message.channel.id))
+
+    async def flush(self, channel_id):
+        batch = self._batches.pop(channel_id, None)
+        if batch is None:
+            return
+        deleter = bot.deferred_deleter
+        calls_before = deleter.api_calls
+        start = time.perf_counter()
+        await deleter.delete_now(channel_id, batch['ids'])
+        bot.metrics.observe('bulk_delete', time.perf_counter() - start)
+        calls = deleter.api_calls - calls_before
+        count = len(batch['ids'])
+        authors = list(batch['authors'].values())
+        mentions = ', '.join(authors[:10]) + (f" and {len(authors) - 10} more" if len(authors) > 10 else '')
+        try:
+            warning_msg = await batch['channel'].send(
+                f"🚫 Removed **{count}** message(s) containing inappropriate server invites from {mentions}.\n"
+                f"Raid protection is active in this channel."
+            )
+            calls += 1
+            deleter.schedule(channel_id, warning_msg.id, WARNING_LIFETIME)
+        except Exception:
+            pass
+        # Handled one by one, every message would cost a delete, a warning
+        # and a warning delete; the batch's own warning delete is counted
+        # as one more call.
+        self.batches += 1
+        self.batched_messages += count
+        self.api_calls_saved += max(0, 3 * count - (calls + 1))
+        print(f"Raid batch in channel {channel_id}: removed {count} message(s) for {', '.join(sorted(batch['names']))}")
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'raids': self.raids,
+            'active_channels': len(self.active_channels()),
+            'tracked_channels': len(self._hits),
+            'batches': self.batches,
+            'batched_messages': self.batched_messages,
+            'api_calls_saved': self.api_calls_saved,
+        }
+
+
+class ConfigWriter:
+    # Debounced, off-loop persistence for the config file. mark_dirty() (re)arms a short timer; when it fires a snapshot is taken on the event loop and written by a single worker thread through write-temp + fsync + rename, followed by the last-known-good backup. Failed writes are logged, counted and retried; durations are tracked so slow disks show up.
+    def __init__(self, snapshot, delay=CONFIG_SAVE_DELAY, max_delay=CONFIG_SAVE_MAX_DELAY):
+        self.snapshot = snapshot
+        self.delay = delay
+        self.max_delay = max_delay
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='config-writer')
+        self._handle = None
+        self._first_dirty = None
+        self._writes = set()
+        self.writes = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_error = None
+
+    def mark_dirty(self):
+        now = time.monotonic()
+        if self._first_dirty is None:
+            self._first_dirty = now
+        delay = min(self.delay, max(0.0, self._first_dirty + self.max_delay - now))
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = asyncio.get_running_loop().call_later(delay, self._start_write)
+
+    def _start_write(self):
+        self._handle = None
+        self._first_dirty = None
+        task = asyncio.ensure_future(self._write(self.snapshot()))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, data):
+        start = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, save_config_data, data)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Failed to save {config_file} ({self.failures} failure(s) so far): {self.last_error}; retrying")
+            self.mark_dirty()
+            return
+        self.last_duration = time.perf_counter() - start
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.writes += 1
+        print(f"Config saved with {len(data['active_guilds'])} active guilds in {self.last_duration * 1000:.1f} ms")
+
+    async def flush(self):
+        # Write any pending change now and wait for in-flight writes.
+        if self._handle is not None:
+            self._handle.cancel()
+            self._start_write()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'writes': self.writes,
+            'failures': self.failures,
+            'last_duration_ms': round(self.last_duration * 1000, 2),
+            'max_duration_ms': round(self.max_duration * 1000, 2),
+            'last_error': self.last_error,
+        }
+
+
+class Histogram:
+    # Fixed exponential buckets (1us doubling up to ~67s) so observe() is a bisect and two increments; quantiles are estimated by interpolating inside the bucket that holds the requested rank.
+    BOUNDS = tuple(1e-6 * 2 ** i for i in range(27))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.BOUNDS[index - 1] if index > 0 else 0.0
+                upper = self.BOUNDS[index] if index < len(self.BOUNDS) else self.BOUNDS[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.BOUNDS[-1]
+
+
+class FilterMetrics:
+    # Stage latency histograms and event counters for the invite filter, plus rendering as Prometheus text. Counters of the cache, scheduler and other components are pulled from their stats() when rendering instead of being duplicated on the hot path.
+    def __init__(self, stages=METRICS_STAGES):
+        self.histograms = {stage: Histogram() for stage in stages}
+        self.counters = {
+            'messages_scanned': 0,
+            'messages_with_invites': 0,
+            'nsfw_hits': 0,
+            'api_requests': 0,
+            'api_errors': 0,
+            'enforcement_errors': 0,
+            'edits_scanned': 0,
+            'edits_skipped': 0,
+            'attachments_scanned': 0,
+            'attachment_bytes': 0,
+            'blocklist_hits': 0,
+            'allowlist_hits': 0,
+            'spreading_invites': 0,
+            'deferred_give_ups': 0,
+        }
+
+    def observe(self, stage, seconds):
+        self.histograms[stage].observe(seconds)
+
+    def incr(self, name, amount=1):
+        self.counters[name] += amount
+
+    def summary(self):
+        # stage -> (count, p50, p95, p99) in seconds.
+        return {
+            stage: (h.count, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+            for stage, h in self.histograms.items()
+        }
+
+    def render_prometheus(self, components):
+        lines = [
+            '# HELP invite_filter_stage_seconds Latency of invite filter stages.',
+            '# TYPE invite_filter_stage_seconds histogram',
+        ]
+        for stage, h in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(h.BOUNDS, h.counts):
+                cumulative += count
+                lines.append(f'invite_filter_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'invite_filter_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+            lines.append(f'invite_filter_stage_seconds_sum{{stage="{stage}"}} {h.sum:.9f}')
+            lines.append(f'invite_filter_stage_seconds_count{{stage="{stage}"}} {h.count}')
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE invite_filter_{name}_total counter')
+            lines.append(f'invite_filter_{name}_total {value}')
+        for component, stats in components.items():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'invite_filter_{component}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class ScanDedup:
+    # Bounded LRU of message id -> per-part content digests, the invite codes already checked for that message and its author. An edit whose content and embed digests match what was scanned before is skipped; otherwise only codes not checked yet are resolved, so spammers editing the same message do not multiply the resolution load.
+    def __init__(self, maxsize=SCAN_DEDUP_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def record(self, message_id, parts, author=None):
+        # `parts` maps part name ('content', 'embeds') to its text; parts
+        # missing from an edit keep their previous digest. Returns the list
+        # of invite codes in changed parts that were not checked before.
+        state = self._entries.get(message_id)
+        if state is None:
+            state = self._entries[message_id] = {'digests': {}, 'codes': set(), 'author': None}
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(message_id)
+        if author is not None:
+            state['author'] = author
+        new_codes = []
+        for part, text in parts.items():
+            digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+            if state['digests'].get(part) == digest:
+                continue
+            state['digests'][part] = digest
+            for code in extract_invite_codes(text):
+                if code not in state['codes']:
+                    state['codes'].add(code)
+                    new_codes.append(code)
+        return new_codes
+
+    def add_codes(self, message_id, codes):
+        # Register codes found outside the tracked text parts (e.g. in
+        # attachments) and return those not checked before.
+        state = self._entries.get(message_id)
+        if state is None:
+            return list(dict.fromkeys(codes))
+        new_codes = [code for code in dict.fromkeys(codes) if code not in state['codes']]
+        state['codes'].update(new_codes)
+        return new_codes
+
+    def author(self, message_id):
+        state = self._entries.get(message_id)
+        return state['author'] if state else None
+
+
+class IncrementalInviteExtractor:
+    # Runs INVITE_RE over text that arrives in chunks. Only a short tail is carried between chunks: enough to complete an invite whose prefix or code is split at a chunk boundary. A match that touches the end of the buffer might still continue, so it is held back until the next chunk (or finish()) unless it is already longer than any real invite. Each code is reported once.
+    MAX_CODE_LENGTH = 64
+    # Longest prefix plus the two code characters that can precede a match.
+    PREFIX_OVERLAP = len('discordapp.com/invite/') + 2
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._carry = ''
+        self._seen = set()
+
+    def feed(self, data, final=False):
+        # Feed bytes (or str) and return codes completed so far.
+        text = self._decoder.decode(data, final) if isinstance(data, bytes) else data
+        buffer = self._carry + text
+        cut = max(0, len(buffer) - self.PREFIX_OVERLAP)
+        codes = []
+        for match in INVITE_RE.finditer(buffer):
+            if not final and match.end() == len(buffer) and len(match.group(1)) < self.MAX_CODE_LENGTH:
+                cut = match.start()
+                break
+            # Never carry text a reported match already consumed, so the
+            # next scan cannot start a match inside it.
+            cut = max(cut, match.end())
+            code = match.group(1)
+            if code not in self._seen:
+                self._seen.add(code)
+                codes.append(code)
+        self._carry = '' if final else buffer[cut:]
+        return codes
+
+    def finish(self):
+        return self.feed(b'', final=True)
+
+
+class InviteSpreadDetector:
+    # Tracks where each invite code was posted recently across all guilds the bot watches. Every code owns a small map of guild id -> last time the code was seen there, ordered by recency and capped at SPREAD_GUILDS_PER_CODE, so recording a sighting is O(1) and a burst of posts in one guild only refreshes that guild's entry instead of pushing the others out. A code is flagged once the number of guilds seen inside the window reaches the threshold, independent of whether its target has been classified yet. Codes without recent sightings are dropped by a compaction pass that runs at most every SPREAD_COMPACT_INTERVAL seconds, and the table is capped at SPREAD_MAX_CODES by evicting the least recently seen code.
+    def __init__(self, window=SPREAD_WINDOW, threshold=SPREAD_GUILD_THRESHOLD, guilds_per_code=SPREAD_GUILDS_PER_CODE, max_codes=SPREAD_MAX_CODES):
+        self.window = window
+        self.threshold = threshold
+        self.guilds_per_code = max(guilds_per_code, threshold)
+        self.max_codes = max_codes
+        # code -> [OrderedDict of guild id -> last seen, posts]
+        self._codes = OrderedDict()
+        self._flagged = {}
+        self._last_compact = time.monotonic()
+        self.sightings = 0
+        self.flags = 0
+        self.compactions = 0
+        self.evicted = 0
+
+    def record(self, code, guild_id, now=None):
+        # Register a sighting and return True if the code is spreading.
+        # Returns True only once per flag so callers can alert on it.
+        now = time.monotonic() if now is None else now
+        self.sightings += 1
+        entry = self._codes.get(code)
+        if entry is None:
+            entry = self._codes[code] = [OrderedDict(), 0]
+            if len(self._codes) > self.max_codes:
+                self._codes.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._codes.move_to_end(code)
+        guilds = entry[0]
+        guilds[guild_id] = now
+        guilds.move_to_end(guild_id)
+        if len(guilds) > self.guilds_per_code:
+            guilds.popitem(last=False)
+        entry[1] += 1
+        if now - self._last_compact >= SPREAD_COMPACT_INTERVAL:
+            self.compact(now)
+        if code in self._flagged:
+            self._flagged[code] = now
+            return False
+        if self._guild_count(guilds, now, self.threshold) >= self.threshold:
+            self._flagged[code] = now
+            self.flags += 1
+            return True
+        return False
+
+    def _guild_count(self, guilds, now, limit=None):
+        # Guilds seen inside the window, newest first; stops at `limit`.
+        cutoff = now - self.window
+        count = 0
+        for last_seen in reversed(guilds.values()):
+            if last_seen <= cutoff or count == limit:
+                break
+            count += 1
+        return count
+
+    def is_spreading(self, code):
+        return code in self._flagged
+
+    def compact(self, now=None):
+        # Drop guilds and codes whose sightings have left the window.
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.window
+        self._last_compact = now
+        self.compactions += 1
+        for code in list(self._codes):
+            guilds = self._codes[code][0]
+            while guilds and next(iter(guilds.values())) <= cutoff:
+                guilds.popitem(last=False)
+            if not guilds:
+                del self._codes[code]
+        for code in [code for code, seen in self._flagged.items() if seen <= cutoff]:
+            del self._flagged[code]
+
+    def top(self, limit=10, now=None):
+        # (code, guilds in window, posts since the code was first tracked)
+        # for the codes in the most guilds, flagged or not.
+        now = time.monotonic() if now is None else now
+        rows = []
+        for code, (guilds, posts) in self._codes.items():
+            count = self._guild_count(guilds, now)
+            if count:
+                rows.append((code, count, posts))
+        return heapq.nlargest(limit, rows, key=lambda row: (row[1], row[2]))
+
+    def stats(self):
+        return {
+            'codes': len(self._codes),
+            'spreading': len(self._flagged),
+            'sightings': self.sightings,
+            'flags': self.flags,
+            'compactions': self.compactions,
+            'evicted': self.evicted,
+        }
+
+
+class GuildIdList:
+    # Read-only set of guild ids backed by a memory-mapped file of sorted native uint64 values. Loading only maps the file, so startup cost does not depend on the list size, pages are shared with the OS cache, and a membership test is a binary search over the mapped array.
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._mmap = None
+        self._ids = ()
+        self.load()
+
+    def load(self):
+        # (Re)map the file; a missing or empty file gives an empty list.
+        self.close()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        if os.path.getsize(self.path) % array('Q').itemsize:
+            print(f"Ignoring {self.path}: size is not a multiple of 8 bytes")
+            return
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._ids = memoryview(self._mmap).cast('Q')
+
+    def close(self):
+        if isinstance(self._ids, memoryview):
+            self._ids.release()
+        self._ids = ()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __contains__(self, guild_id):
+        ids = self._ids
+        index = bisect.bisect_left(ids, guild_id)
+        return index < len(ids) and ids[index] == guild_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def stats(self):
+        return {'size': len(self._ids), 'mapped_bytes': len(self._ids) * 8}
+
+
+def import_guild_id_list(source, dest, merge=False):
+    # Build a GuildIdList file from a text file with one guild id per line
+    # (blank lines and '#' comments are skipped, extra columns after a comma
+    # or whitespace are ignored). With merge=True the ids already in `dest`
+    # are kept. The file is written atomically; returns the number of ids.
+    ids = array('Q')
+    if merge and os.path.exists(dest):
+        with open(dest, 'rb') as f:
+            ids.frombytes(f.read())
+    skipped = 0
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].replace(',', ' ').split()
+            if not fields:
+                continue
+            try:
+                ids.append(int(fields[0]))
+            except (ValueError, OverflowError):
+                skipped += 1
+    ids = array('Q', sorted(set(ids)))
+    tmp_path = f"{dest}.tmp"
+    with open(tmp_path, 'wb') as f:
+        ids.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, dest)
+    if skipped:
+        print(f"Skipped {skipped} line(s) that were not guild ids")
+    return len(ids)
 
-guilds = load_config()
+
+class InviteModeratorBot(commands.Bot):
+    def __init__(self):
+        # Message content is required to read invite links; the HTTP session is created in setup_hook so it binds to the running event loop and is reused for every invite lookup.
+        intents = discord.Intents.default()
+        intents.message_content = True
+        super().__init__(command_prefix='!', intents=intents)
+        self.http_session = None
+        self.invite_cache = InviteCache()
+        self.guild_verdicts = GuildVerdictMemo()
+        self.invite_flight = SingleFlight()
+        self.invite_scheduler = InviteScheduler()
+        self.verdict_store = VerdictStore()
+        self.deferred_deleter = DeferredDeleter()
+        self.raid_guard = RaidGuard()
+        self.config_writer = ConfigWriter(config_snapshot)
+        self.metrics = FilterMetrics()
+        self.scan_dedup = ScanDedup()
+        self.spread_detector = InviteSpreadDetector()
+        self.guild_blocklist = GuildIdList(GUILD_BLOCKLIST_FILE)
+        self.guild_allowlist = GuildIdList(GUILD_ALLOWLIST_FILE)
+        self.metrics_runner = None
+        self.background_tasks = set()
+
+    async def setup_hook(self):
+        self.http_session = create_http_session()
+        if METRICS_PORT:
+            try:
+                self.metrics_runner = await start_metrics_server(METRICS_PORT)
+                print(f"Serving metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+            except OSError as e:
+                print(f"Could not start metrics server on port {METRICS_PORT}: {e}")
+
+    async def close(self):
+        # Save pending config changes, remove pending warnings, release pooled connections and flush buffered verdicts before the gateway connection is torn down.
+        await self.config_writer.flush()
+        shadow_keywords.close()
+        await self.deferred_deleter.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if self.http_session is not None and not self.http_session.closed:
+            await self.http_session.close()
+        await self.verdict_store.close()
+        await super().close()
+
+
+def create_http_session():
+    # One keep-alive connection pool for all invite lookups so repeated requests skip the TCP/TLS handshake.
+    connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, ttl_dns_cache=300)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    )
+
+def component_stats():
+    # stats() of every component, keyed by the name used in metric names.
+    return {
+        'invite_cache': bot.invite_cache.stats(),
+        'guild_memo': bot.guild_verdicts.stats(),
+        'singleflight': bot.invite_flight.stats(),
+        'scheduler': bot.invite_scheduler.stats(),
+        'deleter': bot.deferred_deleter.stats(),
+        'raid': bot.raid_guard.stats(),
+        'config_writer': bot.config_writer.stats(),
+        'guild_blocklist': bot.guild_blocklist.stats(),
+        'guild_allowlist': bot.guild_allowlist.stats(),
+        'shadow': shadow_keywords.stats(),
+        'spread': bot.spread_detector.stats(),
+    }
+
+async def start_metrics_server(port):
+    # Serve the Prometheus text page on localhost only.
+    from aiohttp import web
+
+    async def metrics_page(request):
+        return web.Response(text=bot.metrics.render_prometheus(component_stats()), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+def spawn_background(coro):
+    # Run a coroutine as a background task, keeping a reference on the bot
+    # until it finishes so it is not garbage collected mid-flight.
+    task = asyncio.ensure_future(coro)
+    bot.background_tasks.add(task)
+    task.add_done_callback(bot.background_tasks.discard)
+    return task
+
+def get_http_session():
+    # Return the bot's pooled session, creating it lazily if a lookup happens before setup_hook has run (or after the session was closed).
+    if bot.http_session is None or bot.http_session.closed:
+        bot.http_session = create_http_session()
+    return bot.http_session
+
+bot = InviteModeratorBot()
+
+config_data = load_config()
+guilds = set(config_data.get('active_guilds', []))
 # List of NSFW keywords to check server names for
 KEYWORDS = [
     'adult', 'sex', 'porn', 'xxx', 'nsfw', 'nude', 'naked', 'erotic', 'sexy', 'hot',
@@ -71,34 +1279,316 @@ KEYWORDS = [
     'x-rated',     'adult entertainment', 'adult content'
 ]
 # TODO: add more keywords if needed
-def create_regex_patterns():
-    # Build a combined regular expression that matches any NSFW keyword or a leetspeak variant and return a single alternation string for re.search(..., re.IGNORECASE); each keyword appears twice in the pattern (escaped literal and a substituted version with simple character classes like 'a' -> '[a@4]') to detect common obfuscations while keeping the pattern compact.
-    patterns = []
-    for keyword in KEYWORDS:
-        escaped_keyword = re.escape(keyword)
-        leet_map = {
-            'a': '[a@4]',
-            'e': '[e3]',
-            'i': '[i1!]',
-            'o': '[o0]',
-            's': '[s$5]',
-            'l': '[l1!]',
-            't': '[t7]'
+
+# Leetspeak and case are folded into one canonical alphabet before matching:
+# uppercase ASCII becomes lowercase, and each substitute character is mapped
+# to the letter it stands for. '1' and '!' can stand for either 'i' or 'l', so
+# 'i', 'l', '1' and '!' all map to one shared placeholder, in keywords and
+# text alike; every keyword therefore has a single trie path, and which of
+# those characters may really stand at each placeholder position is checked
+# on the original text (AMBIGUOUS_ACCEPTS). The mapping is one character to
+# one character, so offsets in the canonical text line up with the original.
+AMBIGUOUS_IL = '\x01'
+CANONICAL_TABLE = str.maketrans({
+    **{chr(c): chr(c + 32) for c in range(ord('A'), ord('Z') + 1)},
+    '@': 'a', '4': 'a',
+    '3': 'e',
+    '0': 'o',
+    '$': 's', '5': 's',
+    '7': 't',
+    'i': AMBIGUOUS_IL, 'I': AMBIGUOUS_IL,
+    'l': AMBIGUOUS_IL, 'L': AMBIGUOUS_IL,
+    '1': AMBIGUOUS_IL, '!': AMBIGUOUS_IL,
+})
+# Characters of the original text accepted for each keyword character that
+# canonicalizes to AMBIGUOUS_IL.
+AMBIGUOUS_ACCEPTS = {'i': 'i1!', 'l': 'l1!', '1': '1!', '!': '1!'}
+
+def canonicalize(text):
+    return text.translate(CANONICAL_TABLE)
+
+def ambiguous_checks(keyword):
+    # (offset, accepted characters) for every position of the keyword whose
+    # canonical form is the shared placeholder.
+    return tuple(
+        (offset, AMBIGUOUS_ACCEPTS[ch])
+        for offset, ch in enumerate(keyword.lower())
+        if ch in AMBIGUOUS_ACCEPTS
+    )
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+def _is_word_boundary(text, index):
+    # Same definition as the regex \b: the characters on either side of the
+    # position differ in whether they are word characters.
+    before = index > 0 and _is_word_char(text[index - 1])
+    after = index < len(text) and _is_word_char(text[index])
+    return before != after
+
+class KeywordMatcher:
+    # Aho-Corasick automaton over the canonical spellings of a keyword list. Building it is proportional to the total keyword length; a scan is a single left-to-right pass over the canonicalized text whose cost does not depend on how many keywords there are. Each candidate hit is confirmed on the original text: the 'i'/'l'/'1'/'!' positions folded together by canonicalize() must hold a character the keyword accepts there, and word boundaries are checked at both ends, matching the \bkeyword\b semantics of the regex this replaces.
+    def __init__(self, keywords):
+        self.keywords = tuple(keywords)
+        self._checks = tuple(ambiguous_checks(keyword) for keyword in self.keywords)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for index, keyword in enumerate(self.keywords):
+            self._insert(canonicalize(keyword), index)
+        self._build_failure_links()
+
+    def _insert(self, variant, index):
+        state = 0
+        for ch in variant:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] += ((len(variant), index),)
+
+    def _build_failure_links(self):
+        # Breadth-first so every state's failure target is final before its
+        # children are processed; outputs are merged along failure links so
+        # a state reports every keyword that ends there.
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] += out[fail[nxt]]
+
+    def search(self, text):
+        # Return the first keyword (by end position) found in text, or None.
+        if not text:
+            return None
+        goto, fail, out, checks = self._goto, self._fail, self._out, self._checks
+        state = 0
+        for pos, ch in enumerate(canonicalize(text)):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                end = pos + 1
+                for length, index in out[state]:
+                    start = end - length
+                    if not (_is_word_boundary(text, start) and _is_word_boundary(text, end)):
+                        continue
+                    if all(text[start + offset].lower() in accepts for offset, accepts in checks[index]):
+                        return self.keywords[index]
+        return None
+
+KEYWORD_MATCHER = KeywordMatcher(KEYWORDS)
+
+# Limits for per-guild keyword overrides.
+GUILD_KEYWORD_LIMIT = 500
+GUILD_KEYWORD_MAX_LENGTH = 100
+# Most 'i'/'l'/'1'/'!' characters a guild keyword may contain; each one is
+# re-checked on the original text for every candidate hit.
+GUILD_KEYWORD_MAX_AMBIGUOUS = 12
+
+def keyword_problem(keyword):
+    # Reason a guild keyword cannot be used, or None if it is fine.
+    if not keyword or len(keyword) > GUILD_KEYWORD_MAX_LENGTH:
+        return f"Keywords must be 1-{GUILD_KEYWORD_MAX_LENGTH} characters long."
+    if len(ambiguous_checks(keyword)) > GUILD_KEYWORD_MAX_AMBIGUOUS:
+        return f"Keywords may contain at most {GUILD_KEYWORD_MAX_AMBIGUOUS} of the letters i, l, 1 and !."
+    return None
+
+class GuildKeywords:
+    # Per-guild additions to and removals from the global KEYWORDS list. Each guild's matcher is built lazily on first use, in a worker thread so a large list never stalls the event loop, and cached together with the guild's version counter, so an edit only rebuilds that guild's matcher. Compiled matchers are shared through a weak mapping keyed by the effective keyword set: guilds with identical lists use one object, guilds without overrides use KEYWORD_MATCHER, and matchers nobody uses any more are freed.
+    def __init__(self, overrides=None):
+        self._overrides = {}
+        self._versions = {}
+        self._matchers = {}
+        self._shared = weakref.WeakValueDictionary()
+        self._building = {}
+        self.builds = 0
+        for guild_id, entry in (overrides or {}).items():
+            added = frozenset(k for k in entry.get('add', []) if keyword_problem(k) is None)
+            if len(added) != len(entry.get('add', [])):
+                print(f"Ignoring invalid keywords saved for guild {guild_id}")
+            removed = frozenset(entry.get('remove', []))
+            if added or removed:
+                self._overrides[int(guild_id)] = (added, removed)
+
+    def overrides(self, guild_id):
+        # (added, removed) keyword sets for a guild.
+        return self._overrides.get(guild_id, (frozenset(), frozenset()))
+
+    def _set(self, guild_id, added, removed):
+        if added or removed:
+            self._overrides[guild_id] = (frozenset(added), frozenset(removed))
+        else:
+            self._overrides.pop(guild_id, None)
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        self._matchers.pop(guild_id, None)
+
+    def add(self, guild_id, keyword):
+        added, removed = self.overrides(guild_id)
+        if keyword in KEYWORDS:
+            self._set(guild_id, added, removed - {keyword})
+        else:
+            self._set(guild_id, added | {keyword}, removed)
+
+    def remove(self, guild_id, keyword):
+        added, removed = self.overrides(guild_id)
+        if keyword in KEYWORDS:
+            self._set(guild_id, added, removed | {keyword})
+        else:
+            self._set(guild_id, added - {keyword}, removed)
+
+    def reset(self, guild_id):
+        self._set(guild_id, (), ())
+
+    async def matcher_for(self, guild_id):
+        if guild_id not in self._overrides:
+            return KEYWORD_MATCHER
+        version = self._versions.get(guild_id, 0)
+        cached = self._matchers.get(guild_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        added, removed = self._overrides[guild_id]
+        effective = frozenset(k for k in KEYWORDS if k not in removed) | added
+        matcher = self._shared.get(effective)
+        if matcher is None:
+            # Concurrent messages for the same list wait for one build.
+            build = self._building.get(effective)
+            if build is None:
+                build = asyncio.get_running_loop().run_in_executor(None, KeywordMatcher, sorted(effective))
+                self._building[effective] = build
+                self.builds += 1
+            try:
+                matcher = await build
+            finally:
+                self._building.pop(effective, None)
+            self._shared[effective] = matcher
+        if self._versions.get(guild_id, 0) == version:
+            self._matchers[guild_id] = (version, matcher)
+        return matcher
+
+    def to_config(self):
+        return {
+            str(guild_id): {'add': sorted(added), 'remove': sorted(removed)}
+            for guild_id, (added, removed) in self._overrides.items()
         }
-        def leet_sub(ch):
-            return leet_map.get(ch.lower(), re.escape(ch))
-        substituted = ''.join(leet_sub(ch) for ch in keyword)
-        patterns.extend([
-            fr'\b{escaped_keyword}\b',
-            fr'\b{substituted}\b',
-        ])
-    # Wrap each alternative in a group and join with '|' so the final
-    # pattern can be used directly in re.search.
-    return '|'.join(f'({pattern})' for pattern in patterns)
-
-PATTERN = create_regex_patterns()
-
-# Regex patterns for matching various Discord invite link formats
+
+    def stats(self):
+        return {'guilds': len(self._overrides), 'shared_matchers': len(self._shared), 'builds': self.builds}
+
+guild_keywords = GuildKeywords(config_data.get('guild_keywords'))
+
+def load_shadow_keywords(path=SHADOW_KEYWORDS_FILE):
+    # Candidate keyword list for shadow evaluation, or None if there is none.
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        keywords = [line.strip().lower() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    return keywords or None
+
+class ShadowKeywordEvaluator:
+    # Runs a candidate keyword list next to KEYWORD_MATCHER without acting on it. The hot path only hands over (guild id, name) pairs through a bounded queue, skipping pairs already evaluated; a background worker matches each name with both lists, times both and records where they disagree. 'added' are names only the candidate flags (likely false positives), 'removed' are names only the live list flags. When the queue is full the oldest names are dropped and counted rather than slowing down enforcement.
+    def __init__(self, keywords=None):
+        self.candidate = None
+        self._queue = deque(maxlen=SHADOW_QUEUE_LIMIT)
+        self._seen = OrderedDict()
+        self._worker = None
+        self.set_candidate(keywords)
+
+    def set_candidate(self, keywords):
+        # Swap in a new candidate list (None disables shadow mode) and start
+        # the comparison from scratch.
+        self.candidate = KeywordMatcher(keywords) if keywords else None
+        self._queue.clear()
+        self._seen.clear()
+        self.live_cost = Histogram()
+        self.candidate_cost = Histogram()
+        self.evaluated = 0
+        self.dropped = 0
+        self.agreed_hits = 0
+        self.added = 0
+        self.removed = 0
+        self.samples = deque(maxlen=SHADOW_SAMPLE_SIZE)
+
+    def submit(self, guild_id, guild_name):
+        if self.candidate is None or not guild_name:
+            return
+        key = (guild_id, guild_name)
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return
+        self._seen[key] = None
+        while len(self._seen) > SHADOW_SEEN_SIZE:
+            self._seen.popitem(last=False)
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(key)
+        if self._worker is None or self._worker.done():
+            self._worker = spawn_background(self._run())
+
+    async def _run(self):
+        # Drain the queue and exit; submit() starts a new worker when names
+        # arrive again, so no task stays alive while there is nothing to do.
+        while self._queue:
+            for _ in range(min(SHADOW_BATCH_SIZE, len(self._queue))):
+                self.evaluate(*self._queue.popleft())
+            # Yield between batches so a backlog never stalls the loop.
+            await asyncio.sleep(0)
+
+    def close(self):
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+
+    def evaluate(self, guild_id, guild_name):
+        candidate = self.candidate
+        if candidate is None:
+            return
+        start = time.perf_counter()
+        live_hit = KEYWORD_MATCHER.search(guild_name)
+        middle = time.perf_counter()
+        candidate_hit = candidate.search(guild_name)
+        end = time.perf_counter()
+        self.live_cost.observe(middle - start)
+        self.candidate_cost.observe(end - middle)
+        self.evaluated += 1
+        if live_hit and candidate_hit:
+            self.agreed_hits += 1
+        elif candidate_hit:
+            self.added += 1
+            self.samples.append(('added', guild_id, guild_name, candidate_hit))
+            print(f"Shadow keywords would also flag {guild_name} ({guild_id}): {candidate_hit}")
+        elif live_hit:
+            self.removed += 1
+            self.samples.append(('removed', guild_id, guild_name, live_hit))
+            print(f"Shadow keywords would no longer flag {guild_name} ({guild_id}): {live_hit}")
+
+    def stats(self):
+        return {
+            'enabled': int(self.candidate is not None),
+            'queued': len(self._queue),
+            'evaluated': self.evaluated,
+            'dropped': self.dropped,
+            'agreed_hits': self.agreed_hits,
+            'added': self.added,
+            'removed': self.removed,
+            'live_seconds': self.live_cost.sum,
+            'candidate_seconds': self.candidate_cost.sum,
+        }
+
+shadow_keywords = ShadowKeywordEvaluator(load_shadow_keywords())
+
+# Regex patterns for matching various Discord invite link formats. These are
+# only kept for extract_invite_codes_legacy, which the extractor benchmark
+# compares against; live code uses INVITE_RE below.
 INVITE_PATTERNS = [
     r'(?:https?://)?(?:www\.)?discord\.(?:gg|io|me|li)/[a-zA-Z0-9]+',
     r'(?:https?://)?(?:www\.)?discord\.com/invite/[a-zA-Z0-9]+',
@@ -109,6 +1599,14 @@ INVITE_PATTERNS = [
     r'discord\.li/[a-zA-Z0-9]+',
 ]
 
+# Single precompiled pattern covering every format above. The optional scheme
+# and "www." prefix never change the captured code, so the pattern starts at
+# the literal "discord" and captures codes of at least 3 characters directly.
+INVITE_RE = re.compile(
+    r'discord(?:app\.com/invite|\.com/invite|\.(?:gg|io|me|li))/([a-z0-9]{3,})',
+    re.IGNORECASE
+)
+
 @bot.event
 async def on_ready():
     # Called once the bot has connected and is ready; set a presence and attempt to sync application commands so slash commands register with Discord while allowing sync failures to be non-fatal.
@@ -140,7 +1638,7 @@ async def activate(interaction: discord.Interaction):
         await interaction.response.send_message(" NSFW invite filtering is already active in this server.", ephemeral=True)
     else:
         guilds.add(guild_id)
-        save_config(guilds)
+        bot.config_writer.mark_dirty()
         await interaction.response.send_message(" NSFW invite filtering has been **activated** for this server.\nI will now monitor and delete messages containing NSFW server invites.", ephemeral=True)
 
 @bot.tree.command(name="deactivate", description="Deactivate NSFW invite filtering for this server")
@@ -159,7 +1657,7 @@ async def deactivate(interaction: discord.Interaction):
         await interaction.response.send_message(" NSFW invite filtering is not active in this server.", ephemeral=True)
     else:
         guilds.remove(guild_id)
-        save_config(guilds)
+        bot.config_writer.mark_dirty()
         await interaction.response.send_message(" NSFW invite filtering has been **deactivated** for this server.", ephemeral=True)
 
 @bot.tree.command(name="status", description="Check if NSFW invite filtering is active")
@@ -173,28 +1671,312 @@ async def status(interaction: discord.Interaction):
     
     await interaction.response.send_message(f"{status_emoji} NSFW invite filtering is {status_text} in this server.", ephemeral=True)
 
-async def get_invite_info(code):
-    # Query Discord's public invite API to retrieve invite metadata.
-    # We only extract the guild name which is sufficient for our
-    # keyword-based NSFW heuristic. Any network or API error results in
-    # returning None so the caller treats the invite as unknown.
+def is_guild_manager(interaction):
+    # Same rule as /activate: Manage Server, Administrator or server owner.
+    perms = interaction.user.guild_permissions
+    return perms.manage_guild or perms.administrator or interaction.user.id == interaction.guild.owner_id
+
+def normalize_keyword(keyword):
+    return ' '.join(keyword.lower().split())
+
+@bot.tree.command(name="keyword_add", description="Add a keyword to this server's NSFW filter")
+@app_commands.describe(keyword="Word or phrase that marks a server name as NSFW")
+async def keyword_add(interaction: discord.Interaction, keyword: str):
+    # Add a guild-specific keyword (or re-enable a global one this guild
+    # had removed). Only this guild's matcher is rebuilt.
+    if not is_guild_manager(interaction):
+        await interaction.response.send_message("You need 'Manage Server', 'Administrator', or be the server owner to use this command.", ephemeral=True)
+        return
+    keyword = normalize_keyword(keyword)
+    added, _ = guild_keywords.overrides(interaction.guild.id)
+    problem = keyword_problem(keyword)
+    if problem:
+        await interaction.response.send_message(problem, ephemeral=True)
+        return
+    if keyword not in KEYWORDS and len(added) >= GUILD_KEYWORD_LIMIT:
+        await interaction.response.send_message(f"This server already has the maximum of {GUILD_KEYWORD_LIMIT} custom keywords.", ephemeral=True)
+        return
+    guild_keywords.add(interaction.guild.id, keyword)
+    bot.config_writer.mark_dirty()
+    await interaction.response.send_message(f" Keyword `{keyword}` is now filtered in this server.", ephemeral=True)
+
+@bot.tree.command(name="keyword_remove", description="Stop filtering a keyword in this server")
+@app_commands.describe(keyword="Word or phrase to stop treating as NSFW")
+async def keyword_remove(interaction: discord.Interaction, keyword: str):
+    # Remove a custom keyword, or exempt this guild from a global one.
+    if not is_guild_manager(interaction):
+        await interaction.response.send_message("You need 'Manage Server', 'Administrator', or be the server owner to use this command.", ephemeral=True)
+        return
+    keyword = normalize_keyword(keyword)
+    added, _ = guild_keywords.overrides(interaction.guild.id)
+    if keyword not in KEYWORDS and keyword not in added:
+        await interaction.response.send_message(f"`{keyword}` is not a filtered keyword in this server.", ephemeral=True)
+        return
+    guild_keywords.remove(interaction.guild.id, keyword)
+    bot.config_writer.mark_dirty()
+    await interaction.response.send_message(f" Keyword `{keyword}` is no longer filtered in this server.", ephemeral=True)
+
+@bot.tree.command(name="keyword_reset", description="Go back to the default NSFW keyword list")
+async def keyword_reset(interaction: discord.Interaction):
+    if not is_guild_manager(interaction):
+        await interaction.response.send_message("You need 'Manage Server', 'Administrator', or be the server owner to use this command.", ephemeral=True)
+        return
+    guild_keywords.reset(interaction.guild.id)
+    bot.config_writer.mark_dirty()
+    await interaction.response.send_message(" This server now uses the default keyword list.", ephemeral=True)
+
+@bot.tree.command(name="keywords", description="Show this server's keyword changes")
+async def keywords(interaction: discord.Interaction):
+    added, removed = guild_keywords.overrides(interaction.guild.id)
+    if not added and not removed:
+        await interaction.response.send_message(f"This server uses the default list of {len(KEYWORDS)} keywords.", ephemeral=True)
+        return
+    added_text = ', '.join(f"`{k}`" for k in sorted(added)) or "none"
+    removed_text = ', '.join(f"`{k}`" for k in sorted(removed)) or "none"
+    await interaction.response.send_message(f"**Added:** {added_text}\n**Removed:** {removed_text}"[:2000], ephemeral=True)
+
+@bot.tree.command(name="filter_stats", description="Show invite filter latency and cache statistics")
+async def filter_stats(interaction: discord.Interaction):
+    # Owner-only view of p50/p95/p99 per hot-path stage plus the main
+    # counters; they cover every server, so guild admins don't get them.
+    # The same data is exported on the metrics port.
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can view filter statistics.", ephemeral=True)
+        return
+    rows = [f"{'stage':<13}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}"]
+    for stage, (count, p50, p95, p99) in bot.metrics.summary().items():
+        rows.append(f"{stage:<13}{count:>8}{p50 * 1000:>8.2f}ms{p95 * 1000:>8.2f}ms{p99 * 1000:>8.2f}ms")
+    cache = bot.invite_cache.stats()
+    counters = bot.metrics.counters
+    rows.append("")
+    rows.append(f"cache: {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.1%}), {cache['size']} entries")
+    rows.append(f"api: {counters['api_requests']} requests, {counters['api_errors']} errors, {bot.invite_flight.saved} coalesced")
+    rows.append(f"messages: {counters['messages_scanned']} scanned, {counters['messages_with_invites']} with invites, {counters['nsfw_hits']} NSFW")
+    await interaction.response.send_message("```\n" + "\n".join(rows) + "\n```", ephemeral=True)
+
+@bot.tree.command(name="reload_guild_lists", description="Reload the imported guild blocklist and allowlist")
+async def reload_guild_lists(interaction: discord.Interaction):
+    # Re-map the list files after `import-guild-list` replaced them. The
+    # lists apply to every server, so only the bot owner may reload them.
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can reload the guild lists.", ephemeral=True)
+        return
+    bot.guild_blocklist.load()
+    bot.guild_allowlist.load()
+    await interaction.response.send_message(
+        f"Loaded {len(bot.guild_blocklist)} blocked and {len(bot.guild_allowlist)} allowed guild ids.", ephemeral=True
+    )
+
+@bot.tree.command(name="spreading_invites", description="Show the invite codes spreading across the most servers")
+async def spreading_invites(interaction: discord.Interaction):
+    # Codes and counts are gathered from every server, so only the bot
+    # owner may list them.
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can view spreading invites.", ephemeral=True)
+        return
+    rows = bot.spread_detector.top(10)
+    if not rows:
+        await interaction.response.send_message(f"No invites were posted in the last {SPREAD_WINDOW // 60} minutes.", ephemeral=True)
+        return
+    lines = [f"{'code':<20}{'servers':>8}{'posts':>7}"]
+    for code, guild_count, sightings in rows:
+        flag = ' spreading' if bot.spread_detector.is_spreading(code) else ''
+        lines.append(f"{code:<20}{guild_count:>8}{sightings:>7}{flag}")
+    await interaction.response.send_message("```\n" + "\n".join(lines) + "\n```", ephemeral=True)
+
+@bot.tree.command(name="shadow_report", description="Compare the candidate keyword list with the live one")
+async def shadow_report(interaction: discord.Interaction):
+    # Owner-only summary of shadow evaluation: disagreements with recent
+    # examples and the match cost of both lists. The examples come from
+    # every server, so guild admins don't get them.
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can view the shadow report.", ephemeral=True)
+        return
+    if shadow_keywords.candidate is None:
+        await interaction.response.send_message(f"Shadow mode is off; put a candidate list in `{SHADOW_KEYWORDS_FILE}` and use /shadow_reload.", ephemeral=True)
+        return
+    stats = shadow_keywords.stats()
+    live, candidate = shadow_keywords.live_cost, shadow_keywords.candidate_cost
+    rows = [
+        f"candidate: {len(shadow_keywords.candidate.keywords)} keywords, live: {len(KEYWORDS)} keywords",
+        f"names: {stats['evaluated']} evaluated, {stats['queued']} queued, {stats['dropped']} dropped",
+        f"both flag: {stats['agreed_hits']}, only candidate: {stats['added']}, only live: {stats['removed']}",
+        f"{'cost':<10}{'p50':>10}{'p99':>10}{'total':>10}",
+        f"{'live':<10}{live.quantile(0.5) * 1e6:>8.1f}us{live.quantile(0.99) * 1e6:>8.1f}us{live.sum * 1000:>8.1f}ms",
+        f"{'candidate':<10}{candidate.quantile(0.5) * 1e6:>8.1f}us{candidate.quantile(0.99) * 1e6:>8.1f}us{candidate.sum * 1000:>8.1f}ms",
+    ]
+    if shadow_keywords.samples:
+        rows.append("")
+        for kind, guild_id, name, keyword in reversed(shadow_keywords.samples):
+            rows.append(f"{kind:<8}{keyword:<12}{name} ({guild_id})")
+    await interaction.response.send_message(("```\n" + "\n".join(rows))[:1990] + "\n```", ephemeral=True)
+
+@bot.tree.command(name="shadow_reload", description="Reload the candidate keyword list for shadow evaluation")
+async def shadow_reload(interaction: discord.Interaction):
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can reload the shadow keyword list.", ephemeral=True)
+        return
+    shadow_keywords.set_candidate(load_shadow_keywords())
+    if shadow_keywords.candidate is None:
+        await interaction.response.send_message("Shadow mode is off.", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"Shadow mode is evaluating {len(shadow_keywords.candidate.keywords)} candidate keywords.", ephemeral=True)
+
+async def get_invite_info(code, priority=PRIORITY_FRESH):
+    # Resolve an invite code to the target guild name, or None if the
+    # invite is invalid or could not be resolved.
+    target = await get_invite_target(code, priority)
+    return target.guild_name if target else None
+
+async def get_invite_target(code, priority=PRIORITY_FRESH):
+    # Resolve an invite code to its InviteTarget, consulting the bot's
+    # cache first. Concurrent misses for the same code share one
+    # resolution through the bot's SingleFlight. InviteLookupDeferred is
+    # passed on to the caller when the API budget is exhausted; any other
+    # failure is treated as "unknown" by every waiter.
+    start = time.perf_counter()
+    cached = bot.invite_cache.get(code)
+    bot.metrics.observe('cache_lookup', time.perf_counter() - start)
+    if cached is not InviteCache._MISSING:
+        return cached
+
     try:
-        async with aiohttp.ClientSession() as session:
-            url = f"https://discord.com/api/v10/invites/{code}"
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    guild_name = data.get('guild', {}).get('name', '')
-                    return guild_name
-                else:
-                    return None
+        return await bot.invite_flight.do(code, lambda: resolve_invite(code, priority))
+    except (asyncio.CancelledError, InviteLookupDeferred):
+        raise
     except Exception:
         return None
 
+async def resolve_invite(code, priority=PRIORITY_FRESH):
+    # Cache miss path: try the on-disk verdict store before spending API
+    # budget. A stored record is promoted into the memory cache for the
+    # rest of its lifetime. Only its guild id and name are reused: the
+    # stored verdict may come from an older keyword list, so the name is
+    # classified again by the caller.
+    try:
+        record = await bot.verdict_store.get(code)
+    except Exception as e:
+        print(f"Invite verdict store unavailable: {e}")
+        record = None
+    if record is not None:
+        remaining = record.expires_at - time.time()
+        if record.verdict == 'invalid':
+            bot.invite_cache.put(code, None, ttl=min(remaining, INVITE_NEGATIVE_TTL))
+            return None
+        target = InviteTarget(record.guild_id, record.guild_name)
+        bot.invite_cache.put(code, target, ttl=min(remaining, INVITE_CACHE_TTL))
+        return target
+    return await fetch_invite_info(code, priority)
+
+async def fetch_invite_info(code, priority=PRIORITY_FRESH):
+    # Query Discord's public invite API for one code once the scheduler
+    # grants a slot, and record the answer in the cache, the guild memo
+    # and the verdict store. A 404 means the invite is unknown or expired,
+    # which is recorded as a negative result; a 429 defers the lookup, and
+    # any other status is transient and not recorded. Network errors
+    # propagate to the caller.
+    scheduler = bot.invite_scheduler
+    metrics = bot.metrics
+    await scheduler.acquire(priority)
+    start = time.perf_counter()
+    try:
+        metrics.incr('api_requests')
+        session = get_http_session()
+        url = INVITE_API_URL.format(code=code)
+        async with session.get(url) as response:
+            scheduler.observe(response.status, response.headers)
+            if response.status == 200:
+                data = await response.json()
+                metrics.observe('invite_api', time.perf_counter() - start)
+                guild = data.get('guild') or {}
+                target = InviteTarget(int(guild['id']) if guild.get('id') else None, guild.get('name', ''))
+                is_nsfw = bot.guild_verdicts.observe(target.guild_id, target.guild_name)
+                bot.invite_cache.put(code, target)
+                bot.verdict_store.put(code, target.guild_id, target.guild_name, 'nsfw' if is_nsfw else 'safe')
+                return target
+            metrics.observe('invite_api', time.perf_counter() - start)
+            if response.status == 404:
+                bot.invite_cache.put(code, None)
+                bot.verdict_store.put(code, None, None, 'invalid', ttl=INVITE_NEGATIVE_TTL)
+                return None
+            metrics.incr('api_errors')
+            if response.status == 429:
+                raise InviteLookupDeferred()
+            return None
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        metrics.incr('api_errors')
+        raise
+    finally:
+        scheduler.release()
+
+async def find_nsfw_invite(codes, limit=INVITE_LOOKUP_CONCURRENCY, priority=PRIORITY_FRESH, matcher=None):
+    # Resolve all codes from one message concurrently (at most `limit` in
+    # flight) and return (hit, deferred): hit is (code, name, reason) for
+    # the first invite whose target guild is NSFW, or None; deferred lists
+    # codes that could not be resolved because the API budget ran out.
+    # The target guild id is checked against the imported blocklist
+    # (reason 'blocklist') and allowlist first, then the name against the
+    # keyword heuristic (reason 'keyword'). Guilds with their own keyword
+    # list pass their matcher; the guild-id memo only holds verdicts for
+    # the default list, so custom matchers scan the name. As soon as one
+    # hit is found the lookups still running are cancelled so the caller
+    # can delete the message without waiting for the slowest invite.
+    semaphore = asyncio.Semaphore(limit)
+    deferred = []
+
+    async def check(code):
+        async with semaphore:
+            try:
+                target = await get_invite_target(code, priority)
+            except InviteLookupDeferred:
+                deferred.append(code)
+                return None
+        if not target:
+            return None
+        metrics = bot.metrics
+        start = time.perf_counter()
+        if target.guild_id is not None:
+            if target.guild_id in bot.guild_blocklist:
+                metrics.incr('blocklist_hits')
+                metrics.observe('classify', time.perf_counter() - start)
+                return code, target.guild_name, 'blocklist'
+            if target.guild_id in bot.guild_allowlist:
+                metrics.incr('allowlist_hits')
+                metrics.observe('classify', time.perf_counter() - start)
+                return None
+        if not target.guild_name:
+            return None
+        if matcher is None or matcher is KEYWORD_MATCHER:
+            is_nsfw = bot.guild_verdicts.classify(*target)
+        else:
+            is_nsfw = matcher.search(target.guild_name) is not None
+        metrics.observe('classify', time.perf_counter() - start)
+        shadow_keywords.submit(*target)
+        return (code, target.guild_name, 'keyword') if is_nsfw else None
+
+    pending = {asyncio.ensure_future(check(code)) for code in codes}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    return task.result(), deferred
+        return None, deferred
+    finally:
+        for task in pending:
+            task.cancel()
+
 def extract_invite_codes(text):
-    # Run several regexes that match common Discord invite formats and
-    # return the trailing path segment for each match (the invite code).
-    # Very short tokens are ignored to reduce false positives.
+    # Return each invite code found in the text once, in order of first
+    # appearance. A cheap substring test skips the common case of messages
+    # that cannot contain an invite before the regex runs at all.
+    if not text or 'discord' not in text.lower():
+        return []
+    return list(dict.fromkeys(INVITE_RE.findall(text)))
+
+def extract_invite_codes_legacy(text):
+    # Original multi-regex extractor, kept only as the baseline for
+    # benchmark_extractors. It can return the same code several times.
     codes = []
     for pattern in INVITE_PATTERNS:
         matches = re.findall(pattern, text, re.IGNORECASE)
@@ -204,69 +1986,300 @@ def extract_invite_codes(text):
                 codes.append(code)
     return codes
 
+def build_chat_corpus(size=20000, invite_ratio=0.03, seed=1234):
+    # Synthetic chat log for benchmarks: mostly ordinary lines, some with
+    # URLs or the word "discord", and a small share carrying one or more
+    # invites in the different supported formats.
+    import random
+    rng = random.Random(seed)
+    plain = [
+        "lol that was so good", "anyone up for a game tonight?",
+        "brb dinner", "check this out https://example.com/watch?v=dQw4w9WgXcQ",
+        "the discord update broke my overlay again", "gg wp everyone",
+        "can a mod pin the rules please", "what time is the event on saturday",
+        "i think the patch notes are on the website", "ok",
+    ]
+    formats = [
+        "https://discord.gg/{}", "discord.gg/{}", "https://discord.com/invite/{}",
+        "https://discordapp.com/invite/{}", "discord.io/{}", "www.discord.me/{}",
+    ]
+    codes = [''.join(rng.choice('abcdefghijkmnpqrstuvwxyzABCDEFGH0123456789') for _ in range(rng.randint(6, 10)))
+             for _ in range(50)]
+    corpus = []
+    for _ in range(size):
+        if rng.random() < invite_ratio:
+            links = ' '.join(rng.choice(formats).format(rng.choice(codes)) for _ in range(rng.randint(1, 3)))
+            corpus.append(f"join my server {links} it's great")
+        else:
+            corpus.append(rng.choice(plain))
+    return corpus
+
+def benchmark_extractors(corpus=None, repeat=5):
+    # Time extract_invite_codes against extract_invite_codes_legacy on the
+    # same corpus and report messages per second and codes returned.
+    import timeit
+    corpus = corpus or build_chat_corpus()
+    results = {}
+    for label, func in (('legacy', extract_invite_codes_legacy), ('single-pass', extract_invite_codes)):
+        best = min(timeit.repeat(lambda: [func(text) for text in corpus], number=1, repeat=repeat))
+        returned = sum(len(func(text)) for text in corpus)
+        results[label] = best
+        print(f"{label:>12}: {len(corpus) / best:,.0f} msg/s, {returned} codes returned")
+    print(f"     speedup: {results['legacy'] / results['single-pass']:.1f}x")
+    return results
+
+def match_nsfw_keyword(name):
+    # Return the NSFW keyword that the guild name contains (after leetspeak
+    # and case folding), or None if it looks clean.
+    return KEYWORD_MATCHER.search(name)
+
 def is_nsfw_server_name(name):
-    # Heuristic check: return True if the provided guild name matches
-    # any of the compiled NSFW keyword alternatives. Empty or missing
-    # names return False.
+    # Heuristic check: return True if the provided guild name contains
+    # any NSFW keyword. Empty or missing names return False.
     if not name:
         return False
-    
-    return bool(re.search(PATTERN, name, re.IGNORECASE))
+
+    return match_nsfw_keyword(name) is not None
+
+RawAuthor = namedtuple('RawAuthor', ['id', 'mention'])
+
+def embed_text(embeds):
+    # Text of link-preview embeds that could carry an invite. Accepts
+    # discord.Embed objects or raw embed dicts from gateway payloads.
+    chunks = []
+    for embed in embeds or ():
+        data = embed.to_dict() if hasattr(embed, 'to_dict') else embed
+        chunks.extend(data.get(key) or '' for key in ('url', 'title', 'description'))
+        chunks.append((data.get('author') or {}).get('url') or '')
+        chunks.append((data.get('footer') or {}).get('text') or '')
+        for field in data.get('fields') or ():
+            chunks.append(field.get('value') or '')
+    return '\n'.join(chunk for chunk in chunks if chunk)
 
 @bot.event
 async def on_message(message):
     # Watch messages in configured guilds and remove invites that point
     # to servers we consider NSFW. The handler skips bots and DMs, only
     # runs in guilds listed in the `guilds` set, extracts invite codes
-    # from the message text, asks `get_invite_info` for the target guild
-    # name, and then uses `is_nsfw_server_name` to decide whether to
-    # delete the message and post a short temporary warning to the
-    # channel.
+    # from the message text and embeds, remembers what it scanned so
+    # later edits can be deduplicated, and hands the codes to
+    # `screen_invites`.
     if message.author.bot or not message.guild:
         return
     
     if message.guild.id not in guilds:
         return
     
-    codes = extract_invite_codes(message.content)
-    
-    if codes:
-        for code in codes:
-            name = await get_invite_info(code)
-            
-            if name and is_nsfw_server_name(name):
-                try:
-                    # Remove the offending message to prevent access to
-                    # the invite and notify the author briefly.
-                    await message.delete()
-                    
-                    warning_msg = await message.channel.send(
-                        f"🚫 **{message.author.mention}**, your message was deleted for containing an inappropriate server invite.\n"
-                        f"Server: `{name}`"
-                    )
-                    
-                    # Keep the notification visible for a short time,
-                    # then delete it to keep channels clean.
-                    await asyncio.sleep(5)
-                    try:
-                        await warning_msg.delete()
-                    except Exception:
-                        pass
-                    
-                    print(f"Deleted NSFW invite from {message.author} in {message.guild.name}: {name}")
-                    break
-                    
-                except discord.errors.NotFound:
-                    # Message already deleted or channel removed.
-                    pass
-                except discord.errors.Forbidden:
-                    # Lacking permissions to delete/send messages.
-                    pass
-                except Exception:
-                    # Catch-all to avoid crashing on unexpected runtime
-                    # errors while processing other messages.
-                    pass
+    metrics = bot.metrics
+    metrics.incr('messages_scanned')
+    start = time.perf_counter()
+    parts = {'content': message.content}
+    if message.embeds:
+        parts['embeds'] = embed_text(message.embeds)
+    codes = bot.scan_dedup.record(message.id, parts, RawAuthor(message.author.id, message.author.mention))
+    metrics.observe('extract', time.perf_counter() - start)
+    if codes and await screen_invites(message, codes):
+        return
+
+    if SCAN_TEXT_ATTACHMENTS and message.attachments:
+        codes = bot.scan_dedup.add_codes(message.id, await scan_text_attachments(message))
+        if codes:
+            await screen_invites(message, codes)
+
+
+class EditedMessage:
+    # Just enough of a discord.Message for remove_nsfw_invite when all we have is a raw edit payload: deletion goes through a PartialMessage, so the original message does not have to be in the cache.
+    def __init__(self, message_id, channel, guild, author):
+        self.id = message_id
+        self.channel = channel
+        self.guild = guild
+        self.author = author
+
+    async def delete(self):
+        await self.channel.get_partial_message(self.id).delete()
+
+
+@bot.event
+async def on_raw_message_edit(payload):
+    # Spammers post a clean message and edit an invite in later, and link
+    # previews arrive as embed-only updates. Raw edits fire whether or not
+    # the message is cached; the dedup map skips edits whose content and
+    # embeds did not change and only resolves codes not checked before.
+    if payload.guild_id is None or payload.guild_id not in guilds:
+        return
+    data = payload.data
+    raw_author = data.get('author')
+    if raw_author and raw_author.get('bot'):
+        return
+    parts = {}
+    if 'content' in data:
+        parts['content'] = data['content'] or ''
+    if 'embeds' in data:
+        parts['embeds'] = embed_text(data['embeds'])
+    if not parts:
+        return
+
+    metrics = bot.metrics
+    author = RawAuthor(int(raw_author['id']), f"<@{raw_author['id']}>") if raw_author else None
+    start = time.perf_counter()
+    codes = bot.scan_dedup.record(payload.message_id, parts, author)
+    metrics.observe('extract', time.perf_counter() - start)
+    if not codes:
+        metrics.incr('edits_skipped')
+        return
+    metrics.incr('edits_scanned')
+
+    guild = bot.get_guild(payload.guild_id)
+    if guild is None:
+        return
+    channel = bot.get_channel(payload.channel_id) or bot.get_partial_messageable(payload.channel_id, guild_id=payload.guild_id)
+    author = bot.scan_dedup.author(payload.message_id) or RawAuthor(0, "someone")
+    await screen_invites(EditedMessage(payload.message_id, channel, guild, author), codes)
+
+async def screen_invites(message, codes):
+    # Resolve a message's invite codes and remove the message if any of
+    # them points to an NSFW guild; returns True if it was removed. Every
+    # code is first recorded with the spread detector, so a code posted
+    # across many guilds is flagged before its lookup finishes. When the
+    # API budget is exhausted, rather than letting the invites through,
+    # re-check them in the background at low priority.
+    metrics = bot.metrics
+    metrics.incr('messages_with_invites')
+    for code in codes:
+        if bot.spread_detector.record(code, message.guild.id):
+            metrics.incr('spreading_invites')
+            print(f"Invite {code} is spreading: seen in {SPREAD_GUILD_THRESHOLD}+ servers within {SPREAD_WINDOW}s")
+    hit, deferred = await find_nsfw_invite(codes, matcher=await guild_keywords.matcher_for(message.guild.id))
+    if hit:
+        metrics.incr('nsfw_hits')
+        await remove_nsfw_invite(message, hit[1], hit[2])
+        return True
+    if deferred:
+        spawn_background(recheck_deferred_invites(message, deferred))
+    return False
+
+def is_text_attachment(attachment):
+    content_type = (attachment.content_type or '').split(';')[0].strip()
+    return content_type.startswith('text/') or attachment.filename.lower().endswith(TEXT_ATTACHMENT_EXTENSIONS)
+
+async def scan_text_attachments(message):
+    # Stream each small text attachment through the pooled session and
+    # feed it to an incremental extractor, stopping at ATTACHMENT_MAX_BYTES
+    # per file. Returns the invite codes found across attachments.
+    metrics = bot.metrics
+    codes = []
+    for attachment in [a for a in message.attachments if is_text_attachment(a)][:ATTACHMENT_MAX_COUNT]:
+        start = time.perf_counter()
+        extractor = IncrementalInviteExtractor()
+        read = 0
+        try:
+            async with get_http_session().get(attachment.url) as response:
+                if response.status != 200:
+                    continue
+                async for chunk in response.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    chunk = chunk[:ATTACHMENT_MAX_BYTES - read]
+                    read += len(chunk)
+                    codes.extend(extractor.feed(chunk))
+                    if read >= ATTACHMENT_MAX_BYTES:
+                        break
+            codes.extend(extractor.finish())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Could not read attachment {attachment.filename}: {e}")
+        finally:
+            metrics.incr('attachments_scanned')
+            metrics.incr('attachment_bytes', read)
+            metrics.observe('attachment', time.perf_counter() - start)
+    return codes
+
+async def recheck_deferred_invites(message, codes):
+    # Retry invites that could not be resolved when the message arrived,
+    # waiting for the scheduler's pause to end between attempts. The
+    # deadline moves out while the scheduler is still paused or draining
+    # its queue, so a long raid backlog does not let the message through;
+    # only DEFERRED_RECHECK_MAX bounds it, and every give-up is counted.
+    scheduler = bot.invite_scheduler
+    started = time.monotonic()
+    deadline = started + scheduler.drain_time() + DEFERRED_RECHECK_GRACE
+    while True:
+        await asyncio.sleep(scheduler.retry_delay())
+        hit, codes = await find_nsfw_invite(codes, priority=PRIORITY_RETRY, matcher=await guild_keywords.matcher_for(message.guild.id))
+        if hit:
+            bot.metrics.incr('nsfw_hits')
+            await remove_nsfw_invite(message, hit[1], hit[2])
+            return
+        if not codes:
+            return
+        now = time.monotonic()
+        drain = scheduler.drain_time()
+        if drain > 0:
+            deadline = max(deadline, now + drain + DEFERRED_RECHECK_GRACE)
+        deadline = min(deadline, started + DEFERRED_RECHECK_MAX)
+        if now >= deadline:
+            break
+    bot.metrics.incr('deferred_give_ups')
+    print(f"Gave up resolving {len(codes)} deferred invite(s) in {message.guild.name} after {time.monotonic() - started:.0f}s")
+
+async def remove_nsfw_invite(message, name, reason='keyword'):
+    # Delete the offending message and post a short temporary warning, or
+    # hand it to the raid guard for batched removal when the channel is
+    # under a raid.
+    if bot.raid_guard.record_hit(message.channel.id):
+        bot.raid_guard.enqueue(message, name)
+        return
+
+    try:
+        # Remove the offending message to prevent access to
+        # the invite and notify the author briefly.
+        metrics = bot.metrics
+        start = time.perf_counter()
+        await message.delete()
+        metrics.observe('delete', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        warning_msg = await message.channel.send(
+            f"🚫 **{message.author.mention}**, your message was deleted for containing an inappropriate server invite.\n"
+            f"Server: `{name}`"
+        )
+        metrics.observe('send', time.perf_counter() - start)
+
+        # Keep the notification visible for a short time, then let
+        # the shared deleter remove it so this handler returns now.
+        bot.deferred_deleter.schedule(warning_msg.channel.id, warning_msg.id, WARNING_LIFETIME)
+
+        print(f"Deleted NSFW invite from {message.author} in {message.guild.name}: {name} ({reason})")
+
+    except discord.errors.NotFound:
+        # Message already deleted or channel removed.
+        pass
+    except discord.errors.Forbidden:
+        # Lacking permissions to delete/send messages.
+        bot.metrics.incr('enforcement_errors')
+    except Exception:
+        # Catch-all to avoid crashing on unexpected runtime
+        # errors while processing other messages.
+        bot.metrics.incr('enforcement_errors')
 
 
 if __name__ == "__main__":
-    bot.run(TOKEN)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NSFW invite moderator bot")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help="Run the bot (default)")
+    bench_parser = subparsers.add_parser('bench-extract', help="Benchmark the invite extractor against the legacy one")
+    bench_parser.add_argument('--messages', type=int, default=20000)
+    bench_parser.add_argument('--repeat', type=int, default=5)
+    list_parser = subparsers.add_parser('import-guild-list', help="Import a text file of guild ids into the blocklist or allowlist")
+    list_parser.add_argument('kind', choices=['block', 'allow'])
+    list_parser.add_argument('source', help="Text file with one guild id per line")
+    list_parser.add_argument('--merge', action='store_true', help="Keep the ids already in the list")
+    args = parser.parse_args()
+
+    if args.command == 'bench-extract':
+        benchmark_extractors(build_chat_corpus(args.messages), repeat=args.repeat)
+    elif args.command == 'import-guild-list':
+        dest = GUILD_BLOCKLIST_FILE if args.kind == 'block' else GUILD_ALLOWLIST_FILE
+        count = import_guild_id_list(args.source, dest, merge=args.merge)
+        print(f"Wrote {count} guild ids to {dest}; use /reload_guild_lists or restart the bot to apply")
+    else:
+        bot.run(TOKEN)
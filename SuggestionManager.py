@@ -5,50 +5,522 @@ from discord import app_commands
 import asyncio
 import json
 import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
 from typing import Dict, Any
 
 TOKEN = ""
 
 cfg_file = "configs.json"
+cfg_db_file = "suggestions.db"
 cfg = {}
 
+# Changed guild configs are written at most CFG_FLUSH_DELAY seconds after
+# the last change, and never later than CFG_FLUSH_MAX_DELAY after the first
+# unsaved one, so a burst of votes turns into a single transaction.
+CFG_FLUSH_DELAY = 1.0
+CFG_FLUSH_MAX_DELAY = 5.0
+
+# Message ids of the most recent suggestions sent for approval kept in
+# memory per guild; older ones are looked up in the suggestions table.
+SENT_WINDOW_SIZE = 256
+# Vote counters kept in memory; the rest are read back from the database.
+VOTE_CACHE_SIZE = 20000
+UP_VOTE = '👍'
+DOWN_VOTE = '👎'
+
+# Guild config columns, in table order after guild_id.
+CONFIG_COLUMNS = ('suggestion_channel', 'approval_channel', 'featured_channel', 'threshold')
+# Keys written by older versions of the bot and their current names.
+LEGACY_CONFIG_KEYS = {'sug_ch': 'suggestion_channel', 'app_ch': 'approval_channel', 'feat_ch': 'featured_channel'}
+
+def init_db():
+    conn = sqlite3.connect(cfg_db_file)
+    c = conn.cursor()
+    # One row per guild for its settings and one row per suggestion the bot tracks (currently: sent for approval), so changing a guild or a suggestion only rewrites its own rows no matter how many guilds the bot is in.
+    c.execute('''CREATE TABLE IF NOT EXISTS guild_configs (
+        guild_id INTEGER PRIMARY KEY,
+        suggestion_channel INTEGER,
+        approval_channel INTEGER,
+        featured_channel INTEGER,
+        threshold INTEGER NOT NULL DEFAULT 5
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS suggestions (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS suggestions_guild ON suggestions (guild_id)')
+    c.execute('''CREATE TABLE IF NOT EXISTS approval_requests (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        author_id INTEGER NOT NULL,
+        author_name TEXT NOT NULL,
+        author_avatar TEXT,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS suggestion_votes (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        up INTEGER NOT NULL,
+        down INTEGER NOT NULL
+    )''')
+    # WAL lets the event loop read suggestion rows while the writer thread commits.
+    c.execute('PRAGMA journal_mode=WAL')
+    conn.commit()
+    conn.close()
+
+def import_json_configs(path=cfg_file):
+    # One-time import of a configs.json written by older versions, including the legacy sug_ch/app_ch/feat_ch keys; rows already in the database win over the file. The file is renamed afterwards so the import does not run again. Older versions could leave the file truncated (json.dump failed on the sent_for_approval set partway through), so a file that does not parse is set aside as .corrupt and malformed guild entries are skipped. Returns the number of guilds imported.
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("top level is not an object")
+    except ValueError as e:
+        os.replace(path, f"{path}.corrupt")
+        print(f"Could not import {path} ({e}); moved it to {path}.corrupt")
+        return 0
+    now = time.time()
+    guild_rows = []
+    suggestion_rows = []
+    skipped = 0
+    for gid, config in data.items():
+        try:
+            config = dict(config)
+            for old_key, new_key in LEGACY_CONFIG_KEYS.items():
+                if old_key in config:
+                    config[new_key] = config.pop(old_key)
+            guild_row = (int(gid),) + tuple(config.get(column) for column in CONFIG_COLUMNS[:3]) + (int(config.get('threshold') or 5),)
+            rows = [(int(message_id), int(gid), 'sent', now) for message_id in config.get('sent_for_approval') or ()]
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        guild_rows.append(guild_row)
+        suggestion_rows.extend(rows)
+    conn = sqlite3.connect(cfg_db_file)
+    c = conn.cursor()
+    c.executemany('INSERT OR IGNORE INTO guild_configs VALUES (?, ?, ?, ?, ?)', guild_rows)
+    c.executemany('INSERT OR IGNORE INTO suggestions VALUES (?, ?, ?, ?)', suggestion_rows)
+    conn.commit()
+    conn.close()
+    os.replace(path, f"{path}.imported")
+    print(f"Imported {len(guild_rows)} server configs and {len(suggestion_rows)} suggestions from {path}")
+    if skipped:
+        print(f"Skipped {skipped} malformed server config(s) in {path}")
+    return len(guild_rows)
+
 def load_configs():
-    # Load the persistent server-specific configuration used by the suggestion system, populate the module-level 'cfg' dictionary, and fall back to an empty mapping on file errors so the bot can continue operating.
+    # Load the persistent server-specific configuration used by the suggestion system, importing an old configs.json first if there is one, populate the module-level 'cfg' dictionary, and fall back to an empty mapping on database errors so the bot can continue operating. A failed import never keeps the rows already in the database from loading.
     global cfg
     try:
-        if os.path.exists(cfg_file):
-            with open(cfg_file, 'r') as f:
-                cfg = json.load(f)
-            print(f"Loaded {len(cfg)} server configs")
-        else:
-            cfg = {}
-            print("No config file found, starting fresh")
-    except Exception:
+        init_db()
+        try:
+            import_json_configs()
+        except Exception as e:
+            print(f"Could not import {cfg_file}: {e}")
+        conn = sqlite3.connect(cfg_db_file)
+        c = conn.cursor()
+        c.execute('SELECT guild_id, suggestion_channel, approval_channel, featured_channel, threshold FROM guild_configs')
         cfg = {}
+        for gid, *values in c.fetchall():
+            cfg[str(gid)] = dict(zip(CONFIG_COLUMNS, values))
+        conn.close()
+        print(f"Loaded {len(cfg)} server configs")
+    except Exception as e:
+        cfg = {}
+        print(f"Could not load server configs: {e}")
 
-def save_configs():
-    # Persist the in-memory configuration to disk; swallow write errors to avoid crashing the bot on I/O failures and allow admins to inspect logs.
-    try:
-        with open(cfg_file, 'w') as f:
-            json.dump(cfg, f, indent=2)
-        print(f"Saved {len(cfg)} server configs")
-    except Exception:
-        pass
+_read_conn = None
+
+def read_db():
+    # Shared connection for short primary-key reads on the event loop; all writes go through config_store.
+    global _read_conn
+    if _read_conn is None:
+        _read_conn = sqlite3.connect(cfg_db_file)
+    return _read_conn
+
+def close_read_db():
+    global _read_conn
+    if _read_conn is not None:
+        _read_conn.close()
+        _read_conn = None
+
+
+class ConfigStore:
+    # Write-behind persistence for guild configs, tracked suggestions, approval requests and vote counts. mark_dirty(), track_suggestion(), save_request(), drop_request() and update_votes() run on the event loop and only queue the changed row; a worker thread with its own sqlite connection writes everything queued in one transaction once changes have settled (bounded by CFG_FLUSH_DELAY / CFG_FLUSH_MAX_DELAY). The event loop never waits on disk I/O, and a change only touches its own rows.
+    def __init__(self, delay=CFG_FLUSH_DELAY, max_delay=CFG_FLUSH_MAX_DELAY):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._guilds = {}
+        self._suggestions = {}
+        self._requests = {}
+        self._dropped = {}
+        self._votes = {}
+        self._first_dirty = None
+        self._last_dirty = None
+        self._closed = False
+        self._thread = None
+        self.marks = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config-writer", daemon=True)
+        self._thread.start()
+
+    def _queue(self, table, key, row):
+        with self._cond:
+            now = time.monotonic()
+            table[key] = row
+            if self._first_dirty is None:
+                self._first_dirty = now
+            self._last_dirty = now
+            self.marks += 1
+            self._cond.notify()
+
+    def mark_dirty(self, gid, config):
+        self._queue(self._guilds, int(gid), (int(gid),) + tuple(config.get(column) for column in CONFIG_COLUMNS))
+
+    def track_suggestion(self, gid, message_id, status='sent'):
+        self._queue(self._suggestions, message_id, (message_id, int(gid), status, time.time()))
+
+    def update_votes(self, gid, message_id, up, down):
+        self._queue(self._votes, message_id, (message_id, int(gid), up, down))
+
+    def save_request(self, record):
+        with self._cond:
+            self._dropped.pop(record.message_id, None)
+        self._queue(self._requests, record.message_id, tuple(record))
+
+    def drop_request(self, message_id):
+        # Delete a stored approval request once its suggestion was handled.
+        with self._cond:
+            self._requests.pop(message_id, None)
+        self._queue(self._dropped, message_id, (message_id,))
+
+    def pending_status(self, message_id):
+        # Status of a suggestion row queued but not written yet, or None.
+        with self._cond:
+            row = self._suggestions.get(message_id)
+        return row[2] if row else None
+
+    def pending_request(self, message_id):
+        with self._cond:
+            return self._requests.get(message_id)
+
+    def pending_votes(self, message_id):
+        # Queued (up, down) for a message, or None.
+        with self._cond:
+            row = self._votes.get(message_id)
+        return row[2:] if row else None
+
+    def _run(self):
+        conn = sqlite3.connect(cfg_db_file)
+        try:
+            while True:
+                with self._cond:
+                    while not (self._guilds or self._suggestions or self._requests or self._dropped or self._votes) and not self._closed:
+                        self._cond.wait()
+                    if not (self._guilds or self._suggestions or self._requests or self._dropped or self._votes):
+                        return
+                    # Let a burst of changes settle before writing, but do
+                    # not hold them back past max_delay; close() flushes at
+                    # once.
+                    while not self._closed:
+                        deadline = min(self._last_dirty + self.delay, self._first_dirty + self.max_delay)
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    guilds, self._guilds = self._guilds, {}
+                    suggestions, self._suggestions = self._suggestions, {}
+                    requests, self._requests = self._requests, {}
+                    dropped, self._dropped = self._dropped, {}
+                    votes, self._votes = self._votes, {}
+                    self._first_dirty = self._last_dirty = None
+                try:
+                    with conn:
+                        conn.executemany(
+                            '''INSERT INTO guild_configs VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT(guild_id) DO UPDATE SET
+                                   suggestion_channel = excluded.suggestion_channel,
+                                   approval_channel = excluded.approval_channel,
+                                   featured_channel = excluded.featured_channel,
+                                   threshold = excluded.threshold''',
+                            guilds.values()
+                        )
+                        conn.executemany(
+                            '''INSERT INTO suggestions VALUES (?, ?, ?, ?)
+                               ON CONFLICT(message_id) DO UPDATE SET
+                                   status = excluded.status, updated_at = excluded.updated_at''',
+                            suggestions.values()
+                        )
+                        conn.executemany('INSERT OR REPLACE INTO approval_requests VALUES (?, ?, ?, ?, ?, ?, ?, ?)', requests.values())
+                        conn.executemany('DELETE FROM approval_requests WHERE message_id = ?', dropped.values())
+                        conn.executemany('INSERT OR REPLACE INTO suggestion_votes VALUES (?, ?, ?, ?)', votes.values())
+                    self.flushes += 1
+                    if guilds or suggestions:
+                        print(f"Saved {len(guilds)} server config(s) and {len(suggestions)} suggestion(s)")
+                except Exception as e:
+                    # Requeue the rows so they are retried after another
+                    # delay, unless a newer version of a row is waiting.
+                    self.errors += 1
+                    print(f"Could not save server configs: {e}")
+                    with self._cond:
+                        if self._closed:
+                            return
+                        now = time.monotonic()
+                        for key, row in guilds.items():
+                            self._guilds.setdefault(key, row)
+                        for key, row in suggestions.items():
+                            self._suggestions.setdefault(key, row)
+                        for key, row in requests.items():
+                            self._requests.setdefault(key, row)
+                        for key, row in dropped.items():
+                            if key not in self._requests:
+                                self._dropped.setdefault(key, row)
+                        for key, row in votes.items():
+                            self._votes.setdefault(key, row)
+                        if self._first_dirty is None:
+                            self._first_dirty = now
+                        self._last_dirty = now
+        finally:
+            conn.close()
+
+    def close(self):
+        # Flush whatever is pending and stop the writer thread.
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+config_store = ConfigStore()
+
+
+class SentSuggestions:
+    # Exact record of which suggestion messages were already sent for approval, in bounded memory. Each guild keeps its last SENT_WINDOW_SIZE message ids in a ring stored as a compact array('Q') (8 bytes per id instead of a set entry plus an int object); an id that is not in the window is looked up in the writer's pending rows and then in the suggestions table by its primary key. Only messages that just reached the vote threshold are checked, so the on-disk lookup is rare.
+    def __init__(self, window_size=SENT_WINDOW_SIZE):
+        self.window_size = window_size
+        self._windows = {}
+        self._next = {}
+        self.lookups = 0
+        self.window_hits = 0
+        self.db_lookups = 0
+        self.db_hits = 0
+        self.lookup_seconds = 0.0
+
+    def add(self, gid, message_id):
+        window = self._windows.get(gid)
+        if window is None:
+            window = self._windows[gid] = array('Q')
+            self._next[gid] = 0
+        if len(window) < self.window_size:
+            window.append(message_id)
+        else:
+            slot = self._next[gid]
+            window[slot] = message_id
+            self._next[gid] = (slot + 1) % self.window_size
+        config_store.track_suggestion(gid, message_id)
+
+    def contains(self, gid, message_id):
+        start = time.perf_counter()
+        self.lookups += 1
+        window = self._windows.get(gid)
+        if window is not None and message_id in window:
+            self.window_hits += 1
+            found = True
+        elif config_store.pending_status(message_id) is not None:
+            found = True
+        else:
+            self.db_lookups += 1
+            row = read_db().execute('SELECT 1 FROM suggestions WHERE message_id = ?', (message_id,)).fetchone()
+            found = row is not None
+            self.db_hits += found
+        self.lookup_seconds += time.perf_counter() - start
+        return found
+
+    def stats(self):
+        return {
+            'guilds': len(self._windows),
+            'window_ids': sum(len(window) for window in self._windows.values()),
+            'window_bytes': sum(window.itemsize * len(window) for window in self._windows.values()),
+            'lookups': self.lookups,
+            'window_hits': self.window_hits,
+            'db_lookups': self.db_lookups,
+            'db_hits': self.db_hits,
+            'avg_lookup_us': self.lookup_seconds / self.lookups * 1e6 if self.lookups else 0.0,
+        }
+
+sent_suggestions = SentSuggestions()
+
+
+def count_votes(reactions):
+    # (up, down) reaction counts of a fetched message.
+    up = down = 0
+    for react in reactions:
+        if str(react.emoji) == UP_VOTE:
+            up = react.count
+        elif str(react.emoji) == DOWN_VOTE:
+            down = react.count
+    return up, down
+
+
+class VoteCounters:
+    # Per-message 👍/👎 counts maintained from raw reaction events, so votes are counted for any suggestion, cached or not, without re-reading its reactions. Counts include every reactor (the bot's own seed reactions too), like Message.reactions does. The most recent VOTE_CACHE_SIZE messages stay in an LRU; every change is queued with config_store, and a counter that was evicted is read back from the write queue or the suggestion_votes table. Reactions added while the bot was offline never reach a stored counter, so a row written by an earlier run is not trusted: like a suggestion that has no stored counter at all, the message is fetched once on its next vote to re-seed it.
+    def __init__(self, maxsize=VOTE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._counts = OrderedDict()
+        # Messages whose counter was seeded or fetched by this process.
+        self._synced = set()
+        self.events = 0
+        self.db_loads = 0
+        self.fetches = 0
+
+    def _store(self, gid, message_id, counts):
+        self._counts[message_id] = counts
+        self._counts.move_to_end(message_id)
+        self._synced.add(message_id)
+        while len(self._counts) > self.maxsize:
+            self._counts.popitem(last=False)
+        config_store.update_votes(gid, message_id, *counts)
+
+    def seed(self, gid, message_id, up=0, down=0):
+        self._store(gid, message_id, [up, down])
+
+    def sync(self, gid, message_id, reactions):
+        # Replace the counter with the counts of a freshly fetched message.
+        self._store(gid, message_id, list(count_votes(reactions)))
+
+    def _load(self, message_id):
+        counts = self._counts.get(message_id)
+        if counts is not None:
+            self._counts.move_to_end(message_id)
+            return counts
+        pending = config_store.pending_votes(message_id)
+        if pending is None:
+            row = read_db().execute('SELECT up, down FROM suggestion_votes WHERE message_id = ?', (message_id,)).fetchone()
+            if row is None or message_id not in self._synced:
+                return None
+            self.db_loads += 1
+            pending = row
+        counts = self._counts[message_id] = list(pending)
+        while len(self._counts) > self.maxsize:
+            self._counts.popitem(last=False)
+        return counts
+
+    async def apply(self, gid, channel_id, message_id, emoji, delta):
+        # Count one reaction added (delta=1) or removed (delta=-1) and return the (up, down) counts after it, or None if the message is gone.
+        self.events += 1
+        counts = self._load(message_id)
+        if counts is None:
+            if delta < 0:
+                # Nothing trustworthy to subtract from; the seed fetch on
+                # the next added vote sees the removal anyway.
+                return None
+            try:
+                message = await bot.get_partial_messageable(channel_id, guild_id=gid).fetch_message(message_id)
+            except discord.HTTPException:
+                return None
+            self.fetches += 1
+            # The fetched counts already include this reaction.
+            self.sync(gid, message_id, message.reactions)
+            return tuple(self._counts[message_id])
+        counts[0 if emoji == UP_VOTE else 1] = max(0, counts[0 if emoji == UP_VOTE else 1] + delta)
+        self._store(gid, message_id, counts)
+        return tuple(counts)
+
+    def stats(self):
+        return {'cached': len(self._counts), 'events': self.events, 'db_loads': self.db_loads, 'fetches': self.fetches}
+
+vote_counters = VoteCounters()
+# Suggestions whose approval message is being prepared.
+approvals_in_flight = set()
+
+
+def benchmark_sent_suggestions(count=100000, guilds=10, probes=20000):
+    # Compare the old in-memory set with SentSuggestions: memory held for `count` sent suggestions spread over `guilds` guilds, and the time of a lookup that hits the window, one that has to go to the table and one for an unknown id. Uses a throwaway database file.
+    import random
+    import tempfile
+    global cfg_db_file
+    saved_db_file = cfg_db_file
+    rng = random.Random(1234)
+    rows = [(mid, i % guilds) for i, mid in enumerate(rng.sample(range(10 ** 17, 10 ** 18), count))]
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg_db_file = os.path.join(tmp, "bench.db")
+        close_read_db()
+        try:
+            init_db()
+            conn = sqlite3.connect(cfg_db_file)
+            with conn:
+                conn.executemany('INSERT INTO suggestions VALUES (?, ?, ?, ?)', ((mid, gid, 'sent', 0.0) for mid, gid in rows))
+            conn.close()
+            legacy = [set() for _ in range(guilds)]
+            for mid, gid in rows:
+                legacy[gid].add(mid)
+            legacy_bytes = sum(sys.getsizeof(ids) + sum(sys.getsizeof(mid) for mid in ids) for ids in legacy)
+            store = SentSuggestions()
+            recent_start = count - guilds * store.window_size
+            for gid in range(guilds):
+                # Windows hold the newest ids; filled directly so no rows
+                # are queued with the writer.
+                store._windows[gid] = array('Q', [mid for mid, g in rows[recent_start:] if g == gid])
+                store._next[gid] = 0
+            print(f"{count} ids in {guilds} guilds: set {legacy_bytes / 1024:.0f} KiB, window {store.stats()['window_bytes'] / 1024:.0f} KiB")
+            samples = (
+                ('window', rows[recent_start:]),
+                ('table', rows[:recent_start]),
+                ('unknown', [(mid, i % guilds) for i, mid in enumerate(rng.sample(range(10 ** 16, 10 ** 17), probes))]),
+            )
+            for label, sample in samples:
+                probe = [sample[rng.randrange(len(sample))] for _ in range(probes)]
+                start = time.perf_counter()
+                for mid, gid in probe:
+                    store.contains(gid, mid)
+                elapsed = time.perf_counter() - start
+                print(f"{label:<8}{elapsed / probes * 1e6:>8.2f}us per lookup")
+        finally:
+            close_read_db()
+            cfg_db_file = saved_db_file
 
 
 class SuggestionBot(commands.Bot):
     def __init__(self):
-        # Require message content and reaction intents to support the suggestion workflow.
+        # Require message content and reaction intents to support the suggestion workflow. Votes are counted from raw reaction events, so no message cache is kept.
         intents = discord.Intents.default()
         intents.message_content = True
         intents.reactions = True
-        super().__init__(command_prefix='!', intents=intents)
+        super().__init__(command_prefix='!', intents=intents, max_messages=None)
         
     async def setup_hook(self):
         # During startup load saved configs and sync slash commands with Discord.
         load_configs()
+        config_store.start()
+        # Approve/Deny buttons carry their suggestion in the custom_id, so
+        # registering the item types once keeps every approval message
+        # working across restarts.
+        self.add_dynamic_items(ApproveButton, DenyButton)
         await self.tree.sync()
         print(f"Synced commands for {self.user}")
+
+    async def close(self):
+        # Write pending config changes before disconnecting.
+        await asyncio.to_thread(config_store.close)
+        close_read_db()
+        await super().close()
     
     async def on_ready(self):
         # Print ready status and set presence so maintainers can verify the bot is active.
@@ -115,33 +587,23 @@ class SuggestionBot(commands.Bot):
 bot = SuggestionBot()
 
 def get_config(gid: int) -> Dict[str, Any]:
-    # Return or create a guild-specific config mapping (channel IDs and threshold); keep 'sent_for_approval' as an in-memory set for fast checks and convert to a list before persisting for JSON compatibility.
+    # Return or create a guild-specific config mapping (channel IDs and threshold); which suggestions were sent for approval is tracked separately by `sent_suggestions`.
     gid_str = str(gid)
     if gid_str not in cfg:
         cfg[gid_str] = {
             'suggestion_channel': None,
             'approval_channel': None,
             'featured_channel': None,
-            'threshold': 5,
-            'sent_for_approval': set()  # Track messages already sent for approval
+            'threshold': 5
         }
-    # Convert old format to new format if needed
-    if 'sug_ch' in cfg[gid_str]:
-        cfg[gid_str]['suggestion_channel'] = cfg[gid_str].pop('sug_ch')
-    if 'app_ch' in cfg[gid_str]:
-        cfg[gid_str]['approval_channel'] = cfg[gid_str].pop('app_ch')
-    if 'feat_ch' in cfg[gid_str]:
-        cfg[gid_str]['featured_channel'] = cfg[gid_str].pop('feat_ch')
-    if 'sent_for_approval' not in cfg[gid_str]:
-        cfg[gid_str]['sent_for_approval'] = set()
     return cfg[gid_str]
 
 def save_config(gid: int, config: Dict[str, Any]):
-    # Update the in-memory config for a guild and persist to disk.
+    # Update the in-memory config for a guild and queue it for saving.
     # The function expects the caller to provide a properly formed
     # config dict (channel ids as integers, threshold as int, etc.).
     cfg[str(gid)] = config
-    save_configs()
+    config_store.mark_dirty(gid, config)
 
 # Provide a `/setup` slash command that configures suggestion, approval, and featured channels plus the thumbs-up threshold for a guild.
 @bot.tree.command(name="setup", description="Setup all channels and threshold in one command")
@@ -241,53 +703,120 @@ async def on_message(msg):
     config = get_config(msg.guild.id)
     
     if msg.channel.id == config['suggestion_channel']:
-        await msg.add_reaction('👍')
-        await msg.add_reaction('👎')
+        vote_counters.seed(msg.guild.id, msg.id)
+        await msg.add_reaction(UP_VOTE)
+        await msg.add_reaction(DOWN_VOTE)
         print(f"Added thumbs up and thumbs down reactions to suggestion in {msg.guild.name}")
 
-# When someone adds a reaction, check whether the message in the suggestion channel reached the configured thumbs-up threshold and send it to the approval channel if so.
+# When someone adds a reaction to a message in the suggestion channel, update its vote counter and, once 👍 reaches the configured threshold and is at least 👎, fetch the message and send it to the approval channel. Raw events fire whether or not the message is cached.
 @bot.event
-async def on_reaction_add(reaction, user):
-    if user.bot:
+async def on_raw_reaction_add(payload):
+    if payload.guild_id is None:
         return
     
-    config = get_config(reaction.message.guild.id)
+    emoji = str(payload.emoji)
+    if emoji not in (UP_VOTE, DOWN_VOTE):
+        return
+    
+    config = get_config(payload.guild_id)
     
     # Only process reactions in suggestion channel
-    if reaction.message.channel.id != config['suggestion_channel']:
+    if payload.channel_id != config['suggestion_channel']:
+        return
+    
+    counts = await vote_counters.apply(payload.guild_id, payload.channel_id, payload.message_id, emoji, 1)
+    
+    # Only thumbs up from people can push a suggestion over the threshold
+    if counts is None or emoji != UP_VOTE or (payload.member is not None and payload.member.bot):
+        return
+    
+    thumbs_up, thumbs_down = counts
+    if not (thumbs_up >= config['threshold'] and thumbs_up >= thumbs_down):
         return
     
     # Check if this message was already sent for approval
-    if reaction.message.id in config['sent_for_approval']:
+    if payload.message_id in approvals_in_flight or sent_suggestions.contains(payload.guild_id, payload.message_id):
         return
     
-    # Only process thumbs up reactions
-    if str(reaction.emoji) != '👍':
+    approvals_in_flight.add(payload.message_id)
+    try:
+        try:
+            msg = await bot.get_partial_messageable(payload.channel_id, guild_id=payload.guild_id).fetch_message(payload.message_id)
+        except discord.HTTPException:
+            return
+        # The fetched reactions are authoritative; resync and re-check.
+        vote_counters.sync(payload.guild_id, msg.id, msg.reactions)
+        thumbs_up, thumbs_down = count_votes(msg.reactions)
+        if thumbs_up >= config['threshold'] and thumbs_up >= thumbs_down:
+            # Mark this message as sent for approval to prevent duplicates;
+            # only once it was posted, so a failed send is retried on the
+            # next vote.
+            if await send_to_approval(payload.guild_id, msg, config):
+                sent_suggestions.add(payload.guild_id, msg.id)
+    finally:
+        approvals_in_flight.discard(payload.message_id)
+
+# Keep vote counters in step when someone takes a reaction back.
+@bot.event
+async def on_raw_reaction_remove(payload):
+    if payload.guild_id is None:
         return
     
-    # Get thumbs up and thumbs down counts
-    thumbs_up = 0
-    thumbs_down = 0
+    emoji = str(payload.emoji)
+    if emoji not in (UP_VOTE, DOWN_VOTE):
+        return
     
-    for react in reaction.message.reactions:
-        if str(react.emoji) == '👍':
-            thumbs_up = react.count
-        elif str(react.emoji) == '👎':
-            thumbs_down = react.count
+    config = get_config(payload.guild_id)
+    if payload.channel_id != config['suggestion_channel']:
+        return
     
-    # Check if thumbs up meets threshold and is greater than or equal to thumbs down
-    if (thumbs_up >= config['threshold'] and thumbs_up >= thumbs_down):
-        # Mark this message as sent for approval to prevent duplicates
-        config['sent_for_approval'].add(reaction.message.id)
-        save_config(reaction.message.guild.id, config)
-        
-        await send_to_approval(reaction.message, config)
+    await vote_counters.apply(payload.guild_id, payload.channel_id, payload.message_id, emoji, -1)
+
+# What an approval needs to know about a suggestion, stored in approval_requests when it is sent for approval (and deleted once it is approved or denied) so buttons do not have to keep the Message around.
+SuggestionRecord = namedtuple('SuggestionRecord', 'message_id guild_id channel_id author_id author_name author_avatar content created_at')
+
+def suggestion_record(guild_id, msg):
+    # The guild id is passed in: a fetched message's guild can be missing from the cache.
+    return SuggestionRecord(
+        msg.id, guild_id, msg.channel.id, msg.author.id, msg.author.display_name,
+        msg.author.display_avatar.url, msg.content, msg.created_at.timestamp()
+    )
 
-# Build and send an approval embed to the configured approval channel and attach the ApprovalView so moderators can accept or deny the suggestion.
-async def send_to_approval(msg, config):
+def suggestion_created_at(record):
+    return datetime.fromtimestamp(record.created_at, timezone.utc)
+
+async def load_suggestion(guild_id, message_id):
+    # Load a suggestion for an approval button from the store. Suggestions sent before they were stored are fetched from the guild's suggestion channel once and stored then. Returns None if the message is gone.
+    row = config_store.pending_request(message_id)
+    if row is None:
+        row = read_db().execute(
+            'SELECT * FROM approval_requests WHERE message_id = ?', (message_id,)
+        ).fetchone()
+    if row is not None:
+        return SuggestionRecord(*row)
+    config = get_config(guild_id)
+    if not config['suggestion_channel']:
+        return None
+    try:
+        msg = await bot.get_partial_messageable(config['suggestion_channel'], guild_id=guild_id).fetch_message(message_id)
+    except discord.HTTPException:
+        return None
+    record = suggestion_record(guild_id, msg)
+    config_store.save_request(record)
+    return record
+
+def suggestion_status(message_id):
+    status = config_store.pending_status(message_id)
+    if status is None:
+        row = read_db().execute('SELECT status FROM suggestions WHERE message_id = ?', (message_id,)).fetchone()
+        status = row[0] if row else None
+    return status
+
+# Build and send an approval embed to the configured approval channel and attach Approve/Deny buttons whose custom_ids identify the suggestion, so moderators can accept or deny it even after a restart. Returns True once the approval message was posted.
+async def send_to_approval(guild_id, msg, config):
     app_ch = bot.get_channel(config['approval_channel'])
     if not app_ch:
-        return
+        return False
     
     embed = discord.Embed(
         title="📋 Suggestion Awaiting Approval",
@@ -301,7 +830,7 @@ async def send_to_approval(msg, config):
     )
     embed.add_field(
         name="👍 Reactions", 
-        value=str(len([r for r in msg.reactions if str(r.emoji) == '👍'])), 
+        value=str(len([r for r in msg.reactions if str(r.emoji) == UP_VOTE])), 
         inline=True
     )
     embed.add_field(
@@ -310,52 +839,92 @@ async def send_to_approval(msg, config):
         inline=True
     )
     
-    view = ApprovalView(msg, config)
+    config_store.save_request(suggestion_record(guild_id, msg))
+    
+    view = discord.ui.View(timeout=None)
+    view.add_item(ApproveButton(guild_id, msg.id))
+    view.add_item(DenyButton(guild_id, msg.id))
     
     await app_ch.send(embed=embed, view=view)
+    return True
 
-# ApprovalView provides Approve and Deny buttons for staff; the Approve button opens an ApprovalModal to collect optional admin notes.
-class ApprovalView(discord.ui.View):
-    def __init__(self, msg, config):
-        super().__init__(timeout=None)
-        self.msg = msg
-        self.config = config
-    
-    @discord.ui.button(label='Approve', style=discord.ButtonStyle.green)
-    async def approve_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not interaction.user.guild_permissions.manage_messages:
-            await interaction.response.send_message("❌ You need `Manage Messages` permission to approve suggestions!", ephemeral=True)
+def closed_approval_view(label):
+    # Replacement view once a suggestion has been handled: a single disabled button saying what happened.
+    view = discord.ui.View()
+    view.add_item(discord.ui.Button(label=label, style=discord.ButtonStyle.secondary, disabled=True))
+    return view
+
+async def check_approval_click(interaction, message_id, action):
+    # Shared checks for both buttons and the approval form: permission and not handled yet. Sends the error reply and returns False if the click should be ignored.
+    if not interaction.user.guild_permissions.manage_messages:
+        await interaction.response.send_message(f"❌ You need `Manage Messages` permission to {action} suggestions!", ephemeral=True)
+        return False
+    if suggestion_status(message_id) in ('approved', 'denied'):
+        await interaction.response.send_message("❌ This suggestion has already been handled!", ephemeral=True)
+        return False
+    return True
+
+# Approve button of an approval message; the guild and suggestion ids live in the custom_id, and the suggestion itself is loaded from the store on click to open an ApprovalModal for optional admin notes.
+class ApproveButton(discord.ui.DynamicItem[discord.ui.Button], template=r'suggestion:approve:(?P<guild_id>[0-9]+):(?P<message_id>[0-9]+)'):
+    def __init__(self, guild_id, message_id):
+        super().__init__(discord.ui.Button(
+            label='Approve',
+            style=discord.ButtonStyle.green,
+            custom_id=f'suggestion:approve:{guild_id}:{message_id}'
+        ))
+        self.guild_id = guild_id
+        self.message_id = message_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(int(match['guild_id']), int(match['message_id']))
+
+    async def callback(self, interaction: discord.Interaction):
+        if not await check_approval_click(interaction, self.message_id, 'approve'):
+            return
+        
+        suggestion = await load_suggestion(self.guild_id, self.message_id)
+        if suggestion is None:
+            await interaction.response.send_message("❌ The original suggestion could not be found!", ephemeral=True)
             return
         
-        modal = ApprovalModal(self.msg, self.config, interaction.message)
+        modal = ApprovalModal(suggestion, interaction.message)
         await interaction.response.send_modal(modal)
-    
-    # Deny button, disables everything
-    @discord.ui.button(label='Deny', style=discord.ButtonStyle.red)
-    async def deny_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not interaction.user.guild_permissions.manage_messages:
-            await interaction.response.send_message("❌ You need `Manage Messages` permission to deny suggestions!", ephemeral=True)
+
+# Deny button, disables everything
+class DenyButton(discord.ui.DynamicItem[discord.ui.Button], template=r'suggestion:deny:(?P<guild_id>[0-9]+):(?P<message_id>[0-9]+)'):
+    def __init__(self, guild_id, message_id):
+        super().__init__(discord.ui.Button(
+            label='Deny',
+            style=discord.ButtonStyle.red,
+            custom_id=f'suggestion:deny:{guild_id}:{message_id}'
+        ))
+        self.guild_id = guild_id
+        self.message_id = message_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(int(match['guild_id']), int(match['message_id']))
+
+    async def callback(self, interaction: discord.Interaction):
+        if not await check_approval_click(interaction, self.message_id, 'deny'):
             return
         
+        config_store.track_suggestion(self.guild_id, self.message_id, 'denied')
+        config_store.drop_request(self.message_id)
+        
         embed = interaction.message.embeds[0]
         embed.title = "❌ Suggestion Denied"
         embed.color = discord.Color.red()
         embed.add_field(name="Denied by", value=interaction.user.mention, inline=True)
         
-        for item in self.children:
-            item.disabled = True
-            if item.label == 'Deny':
-                item.style = discord.ButtonStyle.secondary
-                item.label = 'Denied'
-        
-        await interaction.response.edit_message(embed=embed, view=self)
+        await interaction.response.edit_message(embed=embed, view=closed_approval_view('Denied'))
 
 # ApprovalModal collects an optional admin note when approving a suggestion, posts the approved suggestion to the featured channel, creates a discussion thread, and DMs the suggestion author if possible.
 class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
-    def __init__(self, msg, config, app_msg):
+    def __init__(self, suggestion, app_msg):
         super().__init__()
-        self.msg = msg
-        self.config = config
+        self.suggestion = suggestion
         self.app_msg = app_msg
 
     note = discord.ui.TextInput(
@@ -368,17 +937,25 @@ class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
 
     # Approve and post to featured
     async def on_submit(self, interaction: discord.Interaction):
-        feat_ch = bot.get_channel(self.config['featured_channel'])
+        suggestion = self.suggestion
+        # Someone may have denied or approved it while the form was open.
+        if not await check_approval_click(interaction, suggestion.message_id, 'approve'):
+            return
+        config = get_config(suggestion.guild_id)
+        config_store.track_suggestion(suggestion.guild_id, suggestion.message_id, 'approved')
+        config_store.drop_request(suggestion.message_id)
+        
+        feat_ch = bot.get_channel(config['featured_channel'])
         if feat_ch:
             embed = discord.Embed(
                 title=" Approved Suggestion",
-                description=self.msg.content,
+                description=suggestion.content,
                 color=discord.Color.gold(),
-                timestamp=self.msg.created_at
+                timestamp=suggestion_created_at(suggestion)
             )
             embed.set_author(
-                name=f"Suggested by {self.msg.author.display_name}",
-                icon_url=self.msg.author.display_avatar.url
+                name=f"Suggested by {suggestion.author_name}",
+                icon_url=suggestion.author_avatar
             )
             
             if self.note.value:
@@ -391,7 +968,7 @@ class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
             feat_msg = await feat_ch.send(embed=embed)
             
             try:
-                thread_name = f"💬 Discussion: {self.msg.content[:50]}{'...' if len(self.msg.content) > 50 else ''}"
+                thread_name = f"💬 Discussion: {suggestion.content[:50]}{'...' if len(suggestion.content) > 50 else ''}"
                 thread = await feat_msg.create_thread(
                     name=thread_name,
                     auto_archive_duration=10080
@@ -403,7 +980,7 @@ class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
                     color=discord.Color.blue()
                 )
                 await thread.send(embed=starter)
-                print(f"Created discussion thread for suggestion by {self.msg.author.display_name}")
+                print(f"Created discussion thread for suggestion by {suggestion.author_name}")
                 
             except Exception as e:
                 pass
@@ -413,11 +990,11 @@ class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
                 title="🎉 Your Suggestion Has Been Approved!",
                 description=f"Your suggestion in **{interaction.guild.name}** has been approved and featured!",
                 color=discord.Color.green(),
-                timestamp=self.msg.created_at
+                timestamp=suggestion_created_at(suggestion)
             )
             dm.add_field(
                 name="Your Suggestion",
-                value=self.msg.content[:1000] + ("..." if len(self.msg.content) > 1000 else ""),
+                value=suggestion.content[:1000] + ("..." if len(suggestion.content) > 1000 else ""),
                 inline=False
             )
             
@@ -430,8 +1007,9 @@ class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
             
             dm.set_footer(text=f"Server: {interaction.guild.name}")
             
-            await self.msg.author.send(embed=dm)
-            print(f"Sent approval DM to {self.msg.author.display_name}")
+            author = bot.get_user(suggestion.author_id) or await bot.fetch_user(suggestion.author_id)
+            await author.send(embed=dm)
+            print(f"Sent approval DM to {suggestion.author_name}")
             
         except discord.Forbidden:
             pass
@@ -446,19 +1024,12 @@ class ApprovalModal(discord.ui.Modal, title='Approve Suggestion'):
         if self.note.value:
             embed.add_field(name="Admin Note", value=self.note.value, inline=False)
         
-        view = discord.ui.View()
-        approved_btn = discord.ui.Button(
-            label='✅ Approved', 
-            style=discord.ButtonStyle.secondary,
-            disabled=True
-        )
-        view.add_item(approved_btn)
-        
-        await interaction.response.edit_message(embed=embed, view=view)
-
+        await interaction.response.edit_message(embed=embed, view=closed_approval_view('✅ Approved'))
 
 if __name__ == "__main__":
-    if TOKEN == "YOUR_BOT_TOKEN_HERE":
+    if sys.argv[1:] == ['bench-sent']:
+        benchmark_sent_suggestions()
+    elif TOKEN == "YOUR_BOT_TOKEN_HERE":
         print("Invalid token")
     else:
         bot.run(TOKEN)
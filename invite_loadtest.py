@@ -0,0 +1,279 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+import zlib
+from collections import deque
+
+from aiohttp import web
+
+import Invite_Moderator as moderator
+from Invite_Moderator import InviteScheduler, VerdictStore, bot, guilds, on_message
+
+# Load-testing tools for the invite moderator. Discord is replaced by
+# in-process stand-ins and the invite API by a local aiohttp server, so no
+# token or gateway connection is needed:
+#   python invite_loadtest.py run --rate 200 --duration 10
+#   python invite_loadtest.py standin-api --port 8089
+
+def create_standin_invite_app(names, script=(), latency=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, seed=None):
+    # Local stand-in for Discord's GET /api/v10/invites/{code}, used to
+    # exercise the scheduler and load-test the pipeline without touching
+    # the real API. `names` maps codes to guild names (unknown codes answer
+    # 404). `script` is a sequence of status codes served first, one per
+    # request. After that, each request waits about `latency` seconds and
+    # fails with a 500 or 429 at the given rates. A 429 carries
+    # Retry-After/X-RateLimit headers and a retry_after body like Discord's.
+    rng = random.Random(seed)
+    script = deque(script)
+    stats = {'requests': 0, 'rate_limited': 0, 'errors': 0}
+
+    async def invite(request):
+        stats['requests'] += 1
+        code = request.match_info['code']
+        if script:
+            status = script.popleft()
+        else:
+            if latency:
+                await asyncio.sleep(latency * rng.uniform(0.5, 1.5))
+            roll = rng.random()
+            if roll < rate_limit_rate:
+                status = 429
+            elif roll < rate_limit_rate + error_rate:
+                status = 500
+            else:
+                status = 200 if code in names else 404
+        if status == 429:
+            stats['rate_limited'] += 1
+            return web.json_response(
+                {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                status=429,
+                headers={'Retry-After': str(retry_after), 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': str(retry_after)}
+            )
+        if status == 200:
+            name = names.get(code, code)
+            # Stable fake guild id so codes with the same name share a guild.
+            guild_id = zlib.crc32(name.encode('utf-8')) + 1
+            return web.json_response({'code': code, 'guild': {'id': str(guild_id), 'name': name}})
+        if status >= 500:
+            stats['errors'] += 1
+            return web.json_response({'message': '500: Internal Server Error', 'code': 0}, status=status)
+        return web.json_response({'message': 'Unknown Invite', 'code': 10006}, status=status)
+
+    app = web.Application()
+    app.router.add_get('/api/v10/invites/{code}', invite)
+    app['stats'] = stats
+    return app
+
+
+class LoadTestChannel:
+    # Stand-in text channel: send() returns a stand-in message.
+    def __init__(self, harness, channel_id):
+        self.harness = harness
+        self.id = channel_id
+        self.name = f"load-{channel_id}"
+
+    async def send(self, content=None, **kwargs):
+        self.harness.api_calls += 1
+        return LoadTestMessage(self.harness, self.harness.next_id(), self, None, content or '')
+
+
+class LoadTestMessage:
+    # Stand-in for discord.Message with just what on_message touches; delete() records the time-to-delete.
+    def __init__(self, harness, message_id, channel, author, content):
+        self.harness = harness
+        self.id = message_id
+        self.channel = channel
+        self.guild = harness.guild
+        self.author = author
+        self.content = content
+        self.embeds = []
+        self.attachments = []
+        self.created = time.perf_counter()
+
+    async def delete(self):
+        self.harness.api_calls += 1
+        self.harness.record_delete(self.id)
+
+
+class LoadTestHTTP:
+    # Replaces bot.http for the deferred deleter and raid batches.
+    def __init__(self, harness):
+        self.harness = harness
+
+    async def delete_messages(self, channel_id, message_ids, reason=None):
+        self.harness.api_calls += 1
+        for message_id in message_ids:
+            self.harness.record_delete(message_id)
+
+    async def delete_message(self, channel_id, message_id, reason=None):
+        self.harness.api_calls += 1
+        self.harness.record_delete(message_id)
+
+
+class LoadTestHarness:
+    # Feeds synthetic messages through the real on_message at a target rate against a local stand-in invite API and reports throughput, time-to-delete percentiles and invite API calls per message. Discord itself is replaced by in-process stand-ins, so no token or gateway connection is needed.
+    def __init__(self, rate=100, duration=10, codes=200, invite_ratio=0.2, nsfw_ratio=0.3,
+                 channels=5, latency=0.05, error_rate=0.0, rate_limit_rate=0.0, api_rate=None, seed=1234):
+        self.rng = random.Random(seed)
+        self.rate = rate
+        self.duration = duration
+        self.invite_ratio = invite_ratio
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.api_rate = api_rate
+        self.seed = seed
+        self.guild = type('LoadTestGuild', (), {'id': 424242, 'name': 'load-test'})()
+        self.channels = [LoadTestChannel(self, 1000 + i) for i in range(channels)]
+        self.authors = [
+            type('LoadTestAuthor', (), {'id': 5000 + i, 'bot': False, 'mention': f"<@{5000 + i}>"})()
+            for i in range(50)
+        ]
+        alphabet = 'abcdefghijkmnpqrstuvwxyzABCDEFGH0123456789'
+        self.codes = [''.join(self.rng.choice(alphabet) for _ in range(8)) for _ in range(codes)]
+        nsfw_names = ['Hot Girls 18+', 'NSFW Lounge', 'Sexy Chat', 'Leaks & Pics']
+        safe_names = ['Chess Club', 'Anime Fans', 'Rust Programming', 'Cozy Gaming']
+        self.names = {
+            code: self.rng.choice(nsfw_names if self.rng.random() < nsfw_ratio else safe_names)
+            for code in self.codes
+        }
+        self.api_calls = 0
+        self._ids = itertools.count(1)
+        self._created = {}
+        self.delete_latencies = []
+
+    def next_id(self):
+        return next(self._ids)
+
+    def record_delete(self, message_id):
+        created = self._created.pop(message_id, None)
+        if created is not None:
+            self.delete_latencies.append(time.perf_counter() - created)
+
+    def make_message(self):
+        if self.rng.random() < self.invite_ratio:
+            links = ' '.join(f"https://discord.gg/{self.rng.choice(self.codes)}" for _ in range(self.rng.randint(1, 3)))
+            content = f"come join {links}"
+        else:
+            content = self.rng.choice(["gg", "anyone online?", "the discord app keeps crashing", "lol", "brb"])
+        message = LoadTestMessage(self, self.next_id(), self.rng.choice(self.channels), self.rng.choice(self.authors), content)
+        self._created[message.id] = message.created
+        return message
+
+    async def run(self):
+        app = create_standin_invite_app(self.names, latency=self.latency, error_rate=self.error_rate,
+                                        rate_limit_rate=self.rate_limit_rate, retry_after=0.5, seed=self.seed)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+
+        # Everything patched here is put back in the finally block, so the
+        # harness leaves the imported bot as it found it.
+        saved_url = moderator.INVITE_API_URL
+        saved_http = bot.http
+        saved_session = bot.http_session
+        saved_store = bot.verdict_store
+        saved_scheduler = bot.invite_scheduler
+        saved_guild = self.guild.id in guilds
+        moderator.INVITE_API_URL = f"http://127.0.0.1:{port}/api/v10/invites/{{code}}"
+        bot.http = LoadTestHTTP(self)
+        bot.http_session = None
+        bot.verdict_store = VerdictStore(':memory:')
+        if self.api_rate:
+            bot.invite_scheduler = InviteScheduler(rate=self.api_rate, burst=self.api_rate)
+        guilds.add(self.guild.id)
+
+        total = int(self.rate * self.duration)
+        handlers = []
+        start = time.perf_counter()
+        try:
+            for i in range(total):
+                delay = start + i / self.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                handlers.append(asyncio.ensure_future(on_message(self.make_message())))
+            await asyncio.gather(*handlers, return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            # Let raid batches and deferred re-checks finish.
+            while bot.background_tasks or bot.raid_guard._batches:
+                await asyncio.sleep(0.1)
+            drained = time.perf_counter() - start
+        finally:
+            if not saved_guild:
+                guilds.discard(self.guild.id)
+            if bot.http_session is not None and not bot.http_session.closed:
+                await bot.http_session.close()
+            await bot.verdict_store.close()
+            await runner.cleanup()
+            moderator.INVITE_API_URL = saved_url
+            bot.http = saved_http
+            bot.http_session = saved_session
+            bot.verdict_store = saved_store
+            bot.invite_scheduler = saved_scheduler
+
+        latencies = sorted(self.delete_latencies)
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+
+        report = {
+            'messages': total,
+            'messages_per_second': round(total / elapsed, 1),
+            'drain_seconds': round(drained, 2),
+            'deleted': len(latencies),
+            'time_to_delete_ms': {'p50': round(percentile(0.5), 2), 'p95': round(percentile(0.95), 2), 'p99': round(percentile(0.99), 2)},
+            'invite_api_calls': app['stats']['requests'],
+            'invite_api_calls_per_message': round(app['stats']['requests'] / total, 4) if total else 0.0,
+            'invite_api_429s': app['stats']['rate_limited'],
+            'invite_api_errors': app['stats']['errors'],
+            'discord_api_calls': self.api_calls,
+            'cache_hit_rate': round(bot.invite_cache.stats()['hit_rate'], 4),
+            'coalesced_lookups': bot.invite_flight.saved,
+            'raid_batches': bot.raid_guard.batches,
+        }
+        return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load-testing tools for the invite moderator")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    standin_parser = subparsers.add_parser('standin-api', help="Serve a local stand-in for the invite API (point INVITE_API_URL at it)")
+    standin_parser.add_argument('--port', type=int, default=8089)
+    standin_parser.add_argument('--names', help="JSON file mapping invite codes to guild names")
+    standin_parser.add_argument('--script', default='', help="Comma-separated status codes to serve first, e.g. 429,429,200")
+    load_parser = subparsers.add_parser('run', help="Drive on_message against a local stand-in invite API and report throughput")
+    load_parser.add_argument('--rate', type=float, default=100, help="Messages per second to feed")
+    load_parser.add_argument('--duration', type=float, default=10, help="Seconds to feed messages for")
+    load_parser.add_argument('--codes', type=int, default=200, help="Distinct invite codes in circulation")
+    load_parser.add_argument('--invite-ratio', type=float, default=0.2)
+    load_parser.add_argument('--nsfw-ratio', type=float, default=0.3)
+    load_parser.add_argument('--channels', type=int, default=5)
+    load_parser.add_argument('--latency', type=float, default=0.05, help="Mean stand-in API latency in seconds")
+    load_parser.add_argument('--error-rate', type=float, default=0.0)
+    load_parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    load_parser.add_argument('--api-rate', type=float, default=None, help="Override the scheduler's requests per second")
+    load_parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    if args.command == 'standin-api':
+        names = {}
+        if args.names:
+            with open(args.names, 'r') as f:
+                names = json.load(f)
+        script = [int(status) for status in args.script.split(',') if status.strip()]
+        print(f"Set INVITE_API_URL=http://127.0.0.1:{args.port}/api/v10/invites/{{code}} to use this server")
+        web.run_app(create_standin_invite_app(names, script), host='127.0.0.1', port=args.port)
+    else:
+        harness = LoadTestHarness(
+            rate=args.rate, duration=args.duration, codes=args.codes, invite_ratio=args.invite_ratio,
+            nsfw_ratio=args.nsfw_ratio, channels=args.channels, latency=args.latency,
+            error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+            api_rate=args.api_rate, seed=args.seed
+        )
+        print(json.dumps(asyncio.run(harness.run()), indent=2))
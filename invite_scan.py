@@ -0,0 +1,180 @@
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+
+from Invite_Moderator import (
+    INVITE_MAX_WAIT, INVITE_RATE_PER_SECOND, PRIORITY_RETRY, InviteLookupDeferred,
+    bot, extract_invite_codes, get_invite_target, match_nsfw_keyword
+)
+
+# Offline audit of an exported message history with the bot's own extractor
+# and keyword matcher. Runs without a gateway connection:
+#   python invite_scan.py export.jsonl [--names names.json] [--output hits.jsonl]
+
+# Exported history is read and scanned in chunks of this many lines per
+# worker task.
+SCAN_CHUNK_SIZE = 5000
+# Codes the scheduler deferred are retried this many times.
+SCAN_RETRY_ATTEMPTS = 5
+
+def _read_line_chunks(path, size):
+    # Stream a JSONL file as lists of at most `size` raw lines.
+    with open(path, 'r', encoding='utf-8') as f:
+        chunk = []
+        for line in f:
+            chunk.append(line)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def _scan_chunk(lines):
+    # Worker: parse exported messages and keep those that carry invites.
+    # Returns (messages scanned, [(record, codes), ...]).
+    scanned = 0
+    found = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        scanned += 1
+        codes = extract_invite_codes(record.get('content') or '')
+        if codes:
+            found.append((record, codes))
+    return scanned, found
+
+def _classify_names(names):
+    # Worker: keyword-match a batch of guild names.
+    return [(name, match_nsfw_keyword(name)) for name in names]
+
+class FileInviteResolver:
+    # Resolves invite codes from a local JSON file mapping code -> guild name; codes missing from the file count as invalid invites.
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            self.names = json.load(f)
+
+    def resolve_many(self, codes):
+        return {code: self.names.get(code) for code in codes}
+
+class ApiInviteResolver:
+    # Resolves invite codes through the same cache, verdict store and rate-limited scheduler the bot uses. Codes deferred by the scheduler are retried after its pause; codes that still cannot be resolved are left out of the result.
+    def resolve_many(self, codes):
+        return asyncio.run(self._resolve_all(codes))
+
+    async def _resolve_all(self, codes):
+        results = {}
+        pending = list(codes)
+        # Keep the scheduler's queue short enough that it never defers
+        # requests just because of our own backlog.
+        semaphore = asyncio.Semaphore(max(1, INVITE_RATE_PER_SECOND * INVITE_MAX_WAIT // 2))
+        try:
+            for _ in range(SCAN_RETRY_ATTEMPTS + 1):
+                deferred = []
+
+                async def resolve(code):
+                    async with semaphore:
+                        try:
+                            target = await get_invite_target(code, PRIORITY_RETRY)
+                        except InviteLookupDeferred:
+                            deferred.append(code)
+                            return
+                    results[code] = target.guild_name if target else None
+
+                await asyncio.gather(*(resolve(code) for code in pending))
+                if not deferred:
+                    break
+                pending = deferred
+                await asyncio.sleep(bot.invite_scheduler.retry_delay())
+        finally:
+            if bot.http_session is not None and not bot.http_session.closed:
+                await bot.http_session.close()
+            await bot.verdict_store.close()
+        return results
+
+def scan_export(path, resolver, output, processes=None, chunk_size=SCAN_CHUNK_SIZE):
+    # Audit an exported message history offline. Invite extraction and
+    # keyword matching run in a process pool; each unique code is resolved
+    # once through `resolver`. Offending messages are written to `output`
+    # as JSONL and a summary with throughput is printed. Returns the summary.
+    start = time.perf_counter()
+    messages = 0
+    candidates = []
+    unique_codes = {}
+    with multiprocessing.Pool(processes) as pool:
+        for scanned, found in pool.imap(_scan_chunk, _read_line_chunks(path, chunk_size)):
+            messages += scanned
+            candidates.extend(found)
+            for _, codes in found:
+                unique_codes.update(dict.fromkeys(codes))
+        scan_elapsed = time.perf_counter() - start
+
+        names = resolver.resolve_many(list(unique_codes))
+        unique_names = sorted({name for name in names.values() if name})
+        keywords = {}
+        name_chunks = [unique_names[i:i + chunk_size] for i in range(0, len(unique_names), chunk_size)]
+        for part in pool.imap_unordered(_classify_names, name_chunks):
+            keywords.update(part)
+
+    offending = 0
+    for record, codes in candidates:
+        for code in codes:
+            name = names.get(code)
+            keyword = keywords.get(name) if name else None
+            if keyword:
+                output.write(json.dumps({
+                    'message_id': record.get('id'),
+                    'guild_id': record.get('guild_id'),
+                    'channel_id': record.get('channel_id'),
+                    'author_id': record.get('author_id'),
+                    'code': code,
+                    'guild_name': name,
+                    'keyword': keyword,
+                    'content': record.get('content'),
+                }) + '\n')
+                offending += 1
+                break
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'messages': messages,
+        'messages_with_invites': len(candidates),
+        'unique_codes': len(unique_codes),
+        'unresolved_codes': len(unique_codes) - len(names),
+        'offending_messages': offending,
+        'scan_seconds': round(scan_elapsed, 3),
+        'total_seconds': round(elapsed, 3),
+        'messages_per_second': round(messages / elapsed) if elapsed else 0,
+    }
+    print(
+        f"Scanned {messages} messages ({len(candidates)} with invites, {len(unique_codes)} unique codes) "
+        f"in {elapsed:.2f}s: {summary['messages_per_second']} msg/s, {offending} offending",
+        file=sys.stderr
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Audit an exported JSONL message history offline")
+    parser.add_argument('export', help="JSONL file with one message per line (content, guild_id, channel_id, ...)")
+    parser.add_argument('--names', help="Resolve codes from this JSON file of code -> guild name instead of the API")
+    parser.add_argument('--output', help="Write offending messages here as JSONL (default: stdout)")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=SCAN_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    resolver = FileInviteResolver(args.names) if args.names else ApiInviteResolver()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        scan_export(args.export, resolver, output, processes=args.processes, chunk_size=args.chunk_size)
+    finally:
+        if output is not sys.stdout:
+            output.close()